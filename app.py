@@ -1,20 +1,33 @@
 import os
+import socket
+from base64 import b64encode
+from datetime import timedelta
 
 from flask_cors import CORS
 from flask import Flask, request, jsonify
-from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
-
-from forms import UserAddForm, UserEditForm, LoginForm, MessageForm, ListingAddForm, BookingAddForm
-from models import db, connect_db, User, Listing, Booking, Message, Image
-from helpers import create_token, verify_token
-from upload import upload_to_aws
+from sqlalchemy.orm import selectinload
+
+from schemas import (UserAddSchema, LoginSchema, MessageSchema, ListingSchema,
+                     BookingSchema, CalendarSchema, CalendarBatchSchema,
+                     ListingIdsSchema, ItinerarySchema, MessageHistorySchema,
+                     ProfileStartSchema, ProfileResultSchema)
+from models import (db, connect_db, User, Listing, Booking, Message, IdempotencyKey,
+                    ListingCalendar, Profile)
+from idempotency import idempotent
+from profiler import (is_admin, start_sampling, speedscope,
+                      init_request_profiling)
+from helpers import create_token, verify_token, get_secret_key, ConfigError
+from jobs import enqueue, purge_finished
+from message_archive import (hot_cutoff, load_archived_messages,
+                             archive_cold_messages, ensure_partitions,
+                             partition_messages_table)
 
 app = Flask(__name__)
 CORS(app)
 
-database_url = os.environ['DATABASE_URL']
+database_url = os.environ.get('DATABASE_URL', 'postgresql:///sharebnb')
 # # fix incorrect database URIs currently returned by Heroku's pg setup
 database_url = database_url.replace('postgres://', 'postgresql://')
 
@@ -22,11 +35,125 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
+# may be unset at import (CLI commands); check_config() below rejects
+# requests with a clear error when it is missing
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+
+# the toolbar is only useful in local development; skip importing it otherwise
+if app.debug:
+    from flask_debugtoolbar import DebugToolbarExtension
+    toolbar = DebugToolbarExtension(app)
 
 
 connect_db(app)
+init_request_profiling(app)
+
+# only the `flask db` commands need Flask-Migrate (and alembic, which is slow
+# to import); the flask CLI sets FLASK_RUN_FROM_CLI before loading the app
+if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+
+
+@app.before_request
+def check_config():
+    """Refuse to serve requests without the settings every route relies on.
+
+    Checked here rather than at import so CLI commands and tests can load the
+    app without production config.
+    """
+
+    get_secret_key()
+
+
+@app.errorhandler(ConfigError)
+def handle_config_error(e):
+    app.logger.error("Configuration error: %s", e)
+    return jsonify(error="Server misconfigured"), 500
+
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys():
+    """Delete Idempotency-Key records older than their TTL."""
+
+    count = IdempotencyKey.purge_expired()
+    db.session.commit()
+    print(f"Purged {count} idempotency keys")
+
+
+@app.cli.command('purge-jobs')
+def purge_jobs():
+    """Delete finished background jobs older than a week."""
+
+    count = purge_finished()
+    print(f"Purged {count} finished jobs")
+
+
+@app.cli.command('rebuild-similar')
+def rebuild_similar():
+    """Recompute the similar-listings index from every listing."""
+
+    build_similar_index(get_similar_index(start_builds=False))
+    print("Rebuilt similar-listings index")
+
+
+@app.cli.command('partition-messages')
+def partition_messages():
+    """Convert the messages table to monthly partitions (PostgreSQL only)."""
+
+    if partition_messages_table():
+        print("Partitioned messages by month")
+    else:
+        print("Nothing to do: not PostgreSQL, or already partitioned")
+
+
+@app.cli.command('archive-messages')
+def archive_messages():
+    """Archive months of messages outside the hot window to S3 (or
+    MESSAGE_ARCHIVE_DIR)."""
+
+    ensure_partitions()
+
+    for month, count in archive_cold_messages().items():
+        if count:
+            print(f"Archived {count} messages from {month}")
+
+
+def build_similar_index(index):
+    """Rebuild the similar-listings index from every listing."""
+
+    listings = Listing.query.order_by(Listing.id).all()
+    index.rebuild(listings)
+
+    # listings added while it was building went to the old generation
+    newest = listings[-1].id if listings else 0
+    for listing in Listing.query.filter(Listing.id > newest).order_by(Listing.id):
+        index.add(listing)
+
+    db.session.remove()
+
+
+def get_similar_index(start_builds=True):
+    """Shared similar-listings index; numpy is only imported once it's needed.
+
+    The first call in a web process starts the thread that builds (and
+    periodically rebuilds) this dyno's copy; until it's built, lookups
+    come back empty.
+    """
+
+    from similar import get_similar_index, start_background_builds
+
+    index = get_similar_index()
+
+    if start_builds:
+        def build(index):
+            with app.app_context():
+                build_similar_index(index)
+
+        start_background_builds(index, build)
+
+    return index
+
 
 ##############################################################################
 # User signup/login/logout
@@ -43,15 +170,17 @@ def signup():
     If theres already a user with that username: throw Error
     """
 
-    form_data = request.json
+    form_data, errors = UserAddSchema.validate(request.json)
     image_url = "https://t4.ftcdn.net/jpg/00/64/67/63/360_F_64676383_LdbmhiNM6Ypzb3FM4PPuFP9rHe7ri8Ju.jpg"
     # if request.files['image']:
     #     img_file = request.files['image']
     #     image_url = upload_to_aws(img_file)
 
-    form = UserAddForm(csrf_enabled=False, data=form_data)
+    if not errors:
+        # sign the token first: a misconfigured SECRET_KEY should fail the
+        # request before the user is saved, not look like a duplicate
+        token = create_token(form_data['username'].lower())
 
-    if form.validate_on_submit():
         try:
             User.signup(username=form_data['username'].lower(),
                         password=form_data['password'],
@@ -61,28 +190,25 @@ def signup():
                         image_url=image_url)
 
             db.session.commit()
-            token = create_token(form_data['username'].lower())
             return jsonify(token=token)
 
-        except Exception as e:
+        except IntegrityError as e:
             print(e)
+            db.session.rollback()
 
         return jsonify(message="Error: Duplicate username and/or email"), 401
 
     else:
-        # return jsonify(message=form.errors), 400
-        return jsonify(message="Error: Invalid form input"), 400
+        return jsonify(message="Error: Invalid form input", errors=errors), 400
 
 
 @app.post('/login')
 def login():
     """Handle user login."""
 
-    received = request.json
-
-    form = LoginForm(csrf_enabled=False, data=received)
+    received, errors = LoginSchema.validate(request.json)
 
-    if form.validate_on_submit():
+    if not errors:
 
         user = User.authenticate(username=received['username'].lower(),
                                  password=received['password'])
@@ -94,7 +220,7 @@ def login():
             return jsonify(message="invalid username/password"), 401
 
     else:
-        return jsonify(message="invalid form input"), 400
+        return jsonify(message="invalid form input", errors=errors), 400
 
 
 ##############################################################################
@@ -120,13 +246,33 @@ def get_user_by_id(username):
     return jsonify(user=serialize)
 
 
+def message_history(query, received):
+    """Messages from `query`, newest first, limited to the hot window
+    unless `all` was asked for. Archived months are fetched separately
+    with `archived=YYYY-MM`."""
+
+    if not received.get("all"):
+        query = query.filter(Message.timestamp >= hot_cutoff())
+
+    return query.order_by(Message.timestamp.desc()).all()
+
+
 @app.get('/users/<username>/messages')
 def get_messages_by_user(username):
     """Get list of users messages"""
     # use this on users profile to get all messages
     # sort by from_user for host, sort by l_id for guest, pass as props to child component
 
-    messages = Message.query.filter(Message.to_user == username).all()
+    received, errors = MessageHistorySchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    if received.get("archived"):
+        return jsonify(messages=load_archived_messages(received["archived"],
+                                                       to_user=username))
+
+    messages = message_history(Message.query.filter(Message.to_user == username),
+                               received)
     serialize = [m.serialize() for m in messages]
 
     return jsonify(messages=serialize)
@@ -141,10 +287,21 @@ def get_listings():
     search = request.args.get("q")
     print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$", search)
 
-    if not search:
-        listings = Listing.query.all()
+    received, errors = ListingIdsSchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    # images for every listing in one extra query instead of one per listing
+    query = Listing.query.options(selectinload(Listing.images))
+
+    if received.get("ids"):
+        ids = received["ids"][:100]
+        by_id = {l.id: l for l in query.filter(Listing.id.in_(ids)).all()}
+        listings = [by_id[id] for id in ids if id in by_id]
+    elif not search:
+        listings = query.all()
     else:
-        listings = Listing.query.filter(or_(Listing.title.like(f"%{search}%"),
+        listings = query.filter(or_(Listing.title.like(f"%{search}%"),
                                         Listing.location.like(f"%{search}%"),
                                         Listing.type.like(f"%{search}%"),
                                         Listing.description.like(f"%{search}%")
@@ -156,6 +313,7 @@ def get_listings():
 
 
 @app.post('/listings')
+@idempotent
 def add_listing():
 
     token = request.headers['token']
@@ -165,10 +323,9 @@ def add_listing():
     except:
         return jsonify(error="Unauthorized", status_code=404)
 
-    received = request.form
-    form = ListingAddForm(csrf_enabled=False, data=received)
+    received, errors = ListingSchema.validate(request.form)
 
-    if form.validate_on_submit():
+    if not errors:
 
         try:
             new_listing = Listing.add_listing(title=received['title'],
@@ -180,14 +337,25 @@ def add_listing():
 
             db.session.commit()
 
+            # photos are uploaded to S3 by the worker; the listing's images
+            # fill in once those jobs have run
             if request.files:
                 img_files = request.files.getlist('image')
-                image_urls = [upload_to_aws(file) for file in img_files]
-                for url in image_urls:
-                    Image.add_image(listing_id=new_listing.id,
-                                    user=curr_user['username'], image_url=url)
+                for file in img_files:
+                    enqueue('upload_listing_image',
+                            listing_id=new_listing.id,
+                            user=curr_user['username'],
+                            filename=file.filename,
+                            mimetype=file.mimetype,
+                            data=b64encode(file.read()).decode())
                 db.session.commit()
 
+            try:
+                get_similar_index().add(new_listing)
+            except OSError as e:
+                # `flask rebuild-similar` will pick the listing up later
+                print(e)
+
             serialize = new_listing.serialize()
 
             return jsonify(listing=serialize)
@@ -197,7 +365,7 @@ def add_listing():
             return jsonify(error="database error")
 
     else:
-        return jsonify(errors=form.errors)
+        return jsonify(errors=errors), 400
 
 
 @app.get("/listings/<int:id>")
@@ -209,6 +377,65 @@ def get_listing(id):
     return jsonify(listing=listing)
 
 
+@app.get("/listings/<int:id>/similar")
+def get_similar_listings(id):
+    """Get listings similar to this one, most similar first"""
+
+    listing = Listing.query.get_or_404(id)
+    k = min(max(request.args.get("k", 5, type=int), 1), 50)
+
+    # ask for extra: this dyno's index may still hold listings deleted
+    # through another dyno
+    ids = get_similar_index().similar(listing, k * 2)
+    by_id = {l.id: l for l in Listing.query.filter(Listing.id.in_(ids)).all()}
+    serialize = [by_id[i].serialize() for i in ids if i in by_id][:k]
+
+    return jsonify(listings=serialize)
+
+
+def calendar_range(received):
+    """Dates covered by a validated calendar request, end-exclusive."""
+
+    return received["from"], received["to"] + timedelta(days=1)
+
+
+@app.get("/listings/<int:id>/calendar")
+def get_listing_calendar(id):
+    """Get booked / free days of a listing between `from` and `to`"""
+
+    Listing.query.get_or_404(id)
+
+    received, errors = CalendarSchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    start, end = calendar_range(received)
+    calendar = ListingCalendar.for_listing(id)
+    db.session.commit()
+
+    return jsonify(calendar=calendar.serialize(start, end))
+
+
+@app.get("/listings/calendar")
+def get_listing_calendars():
+    """Get booked / free days for several listings (`ids=1,2,3`) at once"""
+
+    received, errors = CalendarBatchSchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    ids = received["ids"][:100]
+    found = {id for (id,) in
+             db.session.query(Listing.id).filter(Listing.id.in_(ids))}
+    ids = [id for id in ids if id in found]
+
+    start, end = calendar_range(received)
+    calendars = ListingCalendar.for_listings(ids)
+    db.session.commit()
+
+    return jsonify(calendars=[c.serialize(start, end) for c in calendars])
+
+
 @app.delete("/listings/<int:id>")
 def delete_listing(id):
     """Delete a listing"""
@@ -219,6 +446,12 @@ def delete_listing(id):
     db.session.delete(listing)
     db.session.commit()
 
+    try:
+        get_similar_index().remove(id)
+    except OSError as e:
+        # the similar route skips ids that no longer exist anyway
+        print(e)
+
     return jsonify(deleted=listing.id)
 
 
@@ -233,13 +466,23 @@ def get_messages_by_listing(id):
     except:
         return jsonify(error="Unauthorized", status_code=404)
 
-    messages = Message.query.filter(Message.listing_id == id).all()
+    received, errors = MessageHistorySchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    if received.get("archived"):
+        return jsonify(messages=load_archived_messages(received["archived"],
+                                                       listing_id=id))
+
+    messages = message_history(Message.query.filter(Message.listing_id == id),
+                               received)
     serialize = [m.serialize() for m in messages]
 
     return jsonify(messages=serialize)
 
 
 @app.post('/listings/<int:id>/messages')
+@idempotent
 def send_message_by_listing(id):
     """Send a message to a user by listing id"""
 
@@ -250,10 +493,9 @@ def send_message_by_listing(id):
     except:
         return jsonify(error="Unauthorized", status_code=404)
 
-    received = request.json
-    form = MessageForm(csrf_enabled=False, data=received)
+    received, errors = MessageSchema.validate(request.json)
 
-    if form.validate_on_submit():
+    if not errors:
         try:
             new_message = Message.add_message(listing_id=id,
                                               to_user=received['to_user'],
@@ -271,7 +513,7 @@ def send_message_by_listing(id):
             return jsonify(error="database error")
 
     else:
-        return jsonify(errors=form.errors)
+        return jsonify(errors=errors), 400
 
 
 ##############################################################################
@@ -287,6 +529,25 @@ def get_bookings_by_username():
     except:
         return jsonify(error="Unauthorized", status_code=404)
 
+    received, errors = ItinerarySchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    if received.get("view") == "itinerary":
+        page = max(received.get("page", 1), 1)
+        per_page = min(max(received.get("per_page", 20), 1), 100)
+
+        # one extra row tells us whether there's a next page without a COUNT
+        itinerary = Booking.itinerary(curr_user['username'],
+                                      when=received.get("when", "upcoming"),
+                                      limit=per_page + 1,
+                                      offset=(page - 1) * per_page)
+
+        return jsonify(bookings=itinerary[:per_page],
+                       page=page,
+                       perPage=per_page,
+                       hasMore=len(itinerary) > per_page)
+
     bookings = Booking.query.filter(
         Booking.guest == curr_user['username']).all()
 
@@ -296,6 +557,7 @@ def get_bookings_by_username():
 
 
 @app.post('/bookings')
+@idempotent
 def add_booking():
 
     token = request.headers['token']
@@ -305,16 +567,21 @@ def add_booking():
     except:
         return jsonify(error="Unauthorized", status_code=404)
 
-    received = request.json
+    received, errors = BookingSchema.validate(request.json)
+
+    if not errors:
 
-    form = BookingAddForm(csrf_enabled=False, data=received)
+        Listing.query.get_or_404(received['listing_id'])
 
-    if form.validate_on_submit():
+        calendar = ListingCalendar.for_listing(received['listing_id'], lock=True)
+        if not calendar.is_free(received['start_date'], received['end_date']):
+            db.session.rollback()
+            return jsonify(error="Listing is already booked for those dates"), 409
 
         try:
             new_booking = Booking.add_booking(listing_id=received['listing_id'],
-                                              start_date=received['start_date'],
-                                              end_date=received['end_date'],
+                                              start_date=received['start_date'].isoformat(),
+                                              end_date=received['end_date'].isoformat(),
                                               guest=curr_user['username'])
 
             db.session.commit()
@@ -328,7 +595,7 @@ def add_booking():
             return jsonify(error="database error")
 
     else:
-        return jsonify(errors=form.errors)
+        return jsonify(errors=errors), 400
 
 
 @app.get("/bookings/<int:id>")
@@ -345,3 +612,111 @@ def get_booking(id):
     booking = Booking.query.get(id).serialize()
 
     return jsonify(booking=booking)
+
+
+@app.delete("/bookings/<int:id>")
+def cancel_booking(id):
+    """Cancel one of the current user's bookings"""
+
+    token = request.headers['token']
+
+    try:
+        curr_user = verify_token(token)
+    except:
+        return jsonify(error="Unauthorized", status_code=404)
+
+    booking = Booking.query.get_or_404(id)
+
+    if booking.guest != curr_user['username']:
+        return jsonify(error="Unauthorized", status_code=404)
+
+    booking.cancel()
+    db.session.commit()
+
+    return jsonify(deleted=id)
+
+
+##############################################################################
+# Admin routes
+
+def save_profile(profile_id):
+    """on_finish callback storing a finished sampler in profile `profile_id`"""
+
+    def save(sampler):
+        with app.app_context():
+            profile = Profile.query.get(profile_id)
+
+            if profile is not None:
+                profile.elapsed = sampler.elapsed
+                profile.samples = sampler.samples
+                profile.collapsed = sampler.collapsed()
+                db.session.commit()
+
+    return save
+
+
+@app.post('/admin/profile')
+def start_profile():
+    """Start sampling this worker's stacks for `seconds` (admins only)
+
+    The result is stored in the database, so any worker can serve it.
+    """
+
+    if not is_admin(request.headers.get('token')):
+        return jsonify(error="Unauthorized", status_code=404)
+
+    received, errors = ProfileStartSchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    seconds = min(max(received.get("seconds", 10), 1), 120)
+    interval_ms = min(max(received.get("interval_ms", 10), 1), 1000)
+
+    profile = Profile(host=socket.gethostname(), pid=os.getpid(),
+                      seconds=seconds, interval_ms=interval_ms)
+    db.session.add(profile)
+    Profile.purge_old()
+    db.session.commit()
+
+    sampler = start_sampling(seconds, interval_ms / 1000,
+                             on_finish=save_profile(profile.id))
+
+    if sampler is None:
+        db.session.delete(profile)
+        db.session.commit()
+        return jsonify(error="A profile is already running in this worker"), 409
+
+    return jsonify(profile=profile.serialize()), 202
+
+
+@app.get('/admin/profile')
+def get_profile():
+    """Get the latest profile (or `id`) as speedscope JSON or collapsed stacks"""
+
+    if not is_admin(request.headers.get('token')):
+        return jsonify(error="Unauthorized", status_code=404)
+
+    received, errors = ProfileResultSchema.validate(request.args)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    if "id" in received:
+        profile = Profile.query.get(received["id"])
+    else:
+        profile = Profile.query.order_by(Profile.id.desc()).first()
+
+    if profile is None:
+        return jsonify(error="No profile has been taken"), 404
+
+    if profile.collapsed is None:
+        if profile.is_running:
+            return jsonify(profile=profile.serialize()), 202
+
+        return jsonify(error="The profiled worker stopped before it finished",
+                       profile=profile.serialize()), 404
+
+    if received.get("format") == "collapsed":
+        return app.response_class(profile.collapsed, mimetype='text/plain')
+
+    return jsonify(speedscope(profile.collapsed, profile.interval_ms / 1000,
+                              f"{profile.host} worker {profile.pid}"))
@@ -0,0 +1,121 @@
+"""Measure the job queue: enqueue cost and worker throughput.
+
+Run with `python benchmarks/jobs.py [--jobs N] [--workers W] [--payload-bytes B]`.
+By default it uses a throwaway SQLite file; point DATABASE_URL at a
+scratch PostgreSQL database to measure that instead (its tables are
+dropped). Jobs use a no-op handler, so the numbers are the queue's own
+overhead: claiming, running and recording each job.
+
+Results on a 1-CPU VM, SQLite:
+
+                                        5,000 jobs, no payload   2,000 jobs, 100 KB payloads
+    enqueue, one commit each (a request)    846 jobs/s (1.2ms)       625 jobs/s (1.6ms)
+    enqueue, one commit for all          10,869 jobs/s             1,722 jobs/s
+    1 worker                                254 jobs/s               207 jobs/s
+    4 workers                               184 jobs/s               148 jobs/s
+
+SQLite can't reach the 1k jobs/s target. Every claim and every result is
+its own write transaction, and SQLite serialises them, so extra workers
+only add lock contention. On PostgreSQL, claims use FOR UPDATE SKIP
+LOCKED and workers add throughput until the database's commit rate is the
+limit. Those numbers have not been measured here; run this script with
+DATABASE_URL set to get them.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault(
+    'DATABASE_URL', f"sqlite:///{tempfile.mkdtemp(prefix='sharebnb-bench-')}/jobs.db")
+
+from app import app  # noqa: E402
+from models import db, Job  # noqa: E402
+import jobs  # noqa: E402
+
+
+@jobs.job('bench_noop')
+def bench_noop(**payload):
+    pass
+
+
+def reset():
+    Job.query.delete()
+    db.session.commit()
+
+
+def bench_enqueue(n, payload, per_request=True):
+    """Jobs enqueued per second, committing after each one or once at the end."""
+
+    reset()
+    start = time.perf_counter()
+
+    for _ in range(n):
+        jobs.enqueue('bench_noop', data=payload)
+        if per_request:
+            db.session.commit()
+
+    db.session.commit()
+
+    return n / (time.perf_counter() - start)
+
+
+def work():
+    # each process needs its own connections, not ones inherited over fork
+    with app.app_context():
+        db.engine.dispose()
+        jobs.run_worker(burst=True)
+
+
+def bench_workers(n, payload, workers):
+    """Jobs run per second by `workers` worker processes draining `n` jobs."""
+
+    bench_enqueue(n, payload, per_request=False)
+    db.engine.dispose()
+
+    start = time.perf_counter()
+
+    processes = [multiprocessing.Process(target=work) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    elapsed = time.perf_counter() - start
+    done = Job.query.filter_by(status='done').count()
+
+    return done / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--payload-bytes', type=int, default=0)
+    args = parser.parse_args()
+
+    payload = "x" * args.payload_bytes
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        print(f"{db.engine.dialect.name}, {args.jobs:,} jobs, "
+              f"{args.payload_bytes:,} byte payloads")
+
+        rate = bench_enqueue(args.jobs, payload)
+        print(f"enqueue, one commit each: {rate:>10,.0f} jobs/s ({1000 / rate:.2f}ms each)")
+
+        rate = bench_enqueue(args.jobs, payload, per_request=False)
+        print(f"enqueue, one commit:      {rate:>10,.0f} jobs/s")
+
+        for workers in sorted({1, args.workers}):
+            rate = bench_workers(args.jobs, payload, workers)
+            target = "meets" if rate >= 1000 else "below"
+            print(f"{workers} worker(s):              {rate:>10,.0f} jobs/s "
+                  f"({target} the 1,000 jobs/s target)")
@@ -0,0 +1,66 @@
+"""Compare payload validation throughput: compiled schemas vs. WTForms.
+
+Run with `python benchmarks/validation.py`. The WTForms side rebuilds the
+BookingAddForm the routes used before schemas.py, so Flask-WTF has to be
+installed (it is no longer in requirements.txt).
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import BookingSchema  # noqa: E402
+
+PAYLOAD = {
+    "listing_id": "1",
+    "start_date": "2030-01-01",
+    "end_date": "2030-01-04",
+    "guest": "testuser",
+}
+
+ROUNDS = 20_000
+
+
+def bench_schema():
+    return timeit.timeit(lambda: BookingSchema.validate(PAYLOAD), number=ROUNDS)
+
+
+def bench_wtforms():
+    from flask import Flask
+    from flask_wtf import FlaskForm
+    from wtforms import StringField, IntegerField
+    from wtforms.validators import DataRequired
+
+    class BookingAddForm(FlaskForm):
+        """The form add_booking validated with before schemas.py."""
+
+        class Meta:
+            csrf = False
+
+        start_date = StringField('Start Date', validators=[DataRequired()])
+        end_date = StringField('End Date', validators=[DataRequired()])
+        listing_id = IntegerField('Listing ID', validators=[DataRequired()])
+        guest = StringField('Guest', validators=[DataRequired()])
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'bench'
+
+    with app.test_request_context(method='POST'):
+        return timeit.timeit(
+            lambda: BookingAddForm(data=PAYLOAD).validate_on_submit(),
+            number=ROUNDS)
+
+
+if __name__ == '__main__':
+    schema_time = bench_schema()
+    print(f"schemas.BookingSchema: {ROUNDS / schema_time:>10,.0f} validations/s")
+
+    try:
+        forms_time = bench_wtforms()
+    except ImportError:
+        print("WTForms BookingAddForm: skipped (pip install Flask-WTF to compare)")
+    else:
+        print(f"WTForms BookingAddForm: {ROUNDS / forms_time:>10,.0f} validations/s")
+        print(f"speedup: {forms_time / schema_time:.0f}x")
@@ -0,0 +1,10 @@
+"""gunicorn settings; gunicorn reads this file from the working directory."""
+
+
+def post_worker_init(worker):
+    """Start building this dyno's similar-listings index as soon as a
+    worker is up, instead of on the first lookup."""
+
+    from app import get_similar_index
+
+    get_similar_index()
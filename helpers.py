@@ -5,17 +5,31 @@ load_dotenv()
 import jwt
 
 
+class ConfigError(RuntimeError):
+    """A required setting is missing from the environment."""
+
+
+def get_secret_key():
+    """Return SECRET_KEY, failing loudly if it isn't configured."""
+
+    secret_key = os.environ.get('SECRET_KEY')
+
+    if not secret_key:
+        raise ConfigError("SECRET_KEY is not set; it is required to sign and verify tokens")
+
+    return secret_key
+
+
 def create_token(user):
     "Return signed JWT from user data."
 
-    token = jwt.encode({"username": user}, os.environ['SECRET_KEY'], algorithm="HS256")
+    token = jwt.encode({"username": user}, get_secret_key(), algorithm="HS256")
 
     return token
 
 def verify_token(token):
     """authenticate user token"""
 
-    payload = jwt.decode(token, os.environ['SECRET_KEY'], algorithms="HS256")
+    payload = jwt.decode(token, get_secret_key(), algorithms="HS256")
 
     return payload
-
@@ -0,0 +1,196 @@
+"""Idempotency-Key support for POST routes.
+
+A client that retries a POST with the same ``Idempotency-Key`` header gets
+the response recorded for the first attempt instead of creating a second
+booking / listing / message. The key row is inserted *before* the view
+runs, so the primary key constraint decides which of several concurrent
+duplicates gets to do the work; the others see an in-flight key and get a
+409 until the first one finishes (or its lease runs out, if the worker
+handling it died).
+
+Only use this on routes whose responses are safe to keep in the database
+for a day: not on signup/login, whose responses carry tokens.
+"""
+
+import json
+from functools import wraps
+from hashlib import sha256
+
+from flask import request, jsonify, make_response, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from helpers import verify_token
+from models import db, IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+@event.listens_for(Session, 'after_commit')
+def note_view_commit(session):
+    """Remember that the view being run under @idempotent wrote something."""
+
+    if has_request_context() and g.get('idempotent_view_running'):
+        g.idempotent_view_committed = True
+
+
+def request_fingerprint():
+    """Hash what makes this request "the same request" for a retry.
+
+    Form posts are hashed field by field (files by content), not as the raw
+    body, so a client that rebuilds a multipart form with a new boundary
+    still matches its first attempt.
+    """
+
+    digest = sha256()
+
+    def add(*parts):
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode())
+            digest.update(b'\0')
+
+    add(request.headers.get('token', ''))
+
+    if request.form or request.files:
+        for name, value in sorted(request.form.items(multi=True)):
+            add('form', name, value)
+
+        for name, file in request.files.items(multi=True):
+            add('file', name, file.filename, sha256(file.read()).hexdigest())
+            file.stream.seek(0)
+    else:
+        body = request.get_json(silent=True)
+
+        if body is not None:
+            add('json', json.dumps(body, sort_keys=True, separators=(',', ':')))
+        else:
+            add('data', request.get_data(cache=True))
+
+    return digest.hexdigest()
+
+
+def request_user():
+    """Username of the request's token, or "" (the view will refuse it)."""
+
+    try:
+        return verify_token(request.headers.get('token'))['username']
+    except Exception:
+        return ""
+
+
+def claim_key(scoped_key, fingerprint):
+    """Insert an in-flight row for this key; return False if it already exists."""
+
+    db.session.add(IdempotencyKey(key=scoped_key, request_hash=fingerprint))
+
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def release_key(scoped_key):
+    """Forget a key whose request failed before writing anything."""
+
+    db.session.rollback()
+
+    IdempotencyKey.query.filter_by(key=scoped_key).delete()
+    db.session.commit()
+
+
+def record_response(scoped_key, status_code, body):
+    """Store the response to replay for retries of this key."""
+
+    db.session.rollback()
+
+    IdempotencyKey.query.filter_by(key=scoped_key).update({
+        'status_code': status_code,
+        'response_body': body,
+    })
+    db.session.commit()
+
+
+def replay(record, fingerprint):
+    """Build the response for a retry of an already-seen key."""
+
+    if record.request_hash != fingerprint:
+        return jsonify(error="Idempotency-Key was already used for a different request"), 422
+
+    if record.status_code is None:
+        return jsonify(error="A request with this Idempotency-Key is still in progress"), 409
+
+    response = make_response(record.response_body, record.status_code)
+    response.mimetype = 'application/json'
+    response.headers['Idempotent-Replayed'] = 'true'
+
+    return response
+
+
+def idempotent(view):
+    """Honour the Idempotency-Key header on a POST view.
+
+    Requests without the header run exactly as before.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+
+        if not key:
+            return view(*args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify(error="Idempotency-Key is too long"), 400
+
+        # keys are the client's own: two users may well pick the same one
+        scoped_key = f"{request_user()} {request.method} {request.path} {key}"
+        fingerprint = request_fingerprint()
+
+        if not claim_key(scoped_key, fingerprint):
+            record = IdempotencyKey.query.get(scoped_key)
+
+            if record is not None and (record.is_expired or record.is_abandoned):
+                # only delete the row we looked at, not one a racing retry
+                # has just claimed in its place
+                (IdempotencyKey.query
+                 .filter_by(key=scoped_key, created_at=record.created_at)
+                 .delete())
+                db.session.commit()
+                record = None
+
+            if record is not None:
+                return replay(record, fingerprint)
+
+            if not claim_key(scoped_key, fingerprint):
+                return jsonify(error="A request with this Idempotency-Key is still in progress"), 409
+
+        g.idempotent_view_running = True
+        g.idempotent_view_committed = False
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            if g.idempotent_view_committed:
+                # the view's writes are saved; a retry must not redo them
+                record_response(scoped_key, 500,
+                                json.dumps({"error": "Internal server error"}))
+            else:
+                release_key(scoped_key)
+            raise
+        finally:
+            g.idempotent_view_running = False
+
+        if response.status_code >= 500 and not g.idempotent_view_committed:
+            release_key(scoped_key)
+            return response
+
+        record_response(scoped_key, response.status_code,
+                        response.get_data(as_text=True))
+
+        return response
+
+    return wrapper
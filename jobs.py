@@ -0,0 +1,208 @@
+"""Database-backed background job queue.
+
+Request handlers call ``enqueue()`` and return straight away; the worker
+process (``python worker.py``, see the Procfile) claims queued jobs and runs
+the handler registered for each job's name with ``@job``.
+
+On PostgreSQL jobs are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``
+so any number of workers can share the table. SQLite has no row locks, so
+the claim is also guarded by a conditional UPDATE: a job only moves from
+queued to running once, whichever backend is in use.
+"""
+
+import json
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta
+
+from models import db, Job
+
+# job name -> handler function
+HANDLERS = {}
+
+# per-process counters: enqueued, claimed, succeeded, retried, failed
+METRICS = Counter()
+
+BACKOFF_BASE = 5             # seconds before the first retry
+BACKOFF_MAX = 60 * 60        # never wait more than an hour between retries
+STALE_AFTER = timedelta(minutes=15)
+KEEP_FINISHED = timedelta(days=7)     # how long done/failed jobs are kept
+
+
+def job(name):
+    """Register the decorated function as the handler for jobs named `name`."""
+
+    def register(handler):
+        HANDLERS[name] = handler
+        return handler
+
+    return register
+
+
+def enqueue(name, max_attempts=5, delay=0, **payload):
+    """Queue a job; it is committed with the caller's transaction."""
+
+    new_job = Job(
+        name=name,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+
+    db.session.add(new_job)
+    METRICS['enqueued'] += 1
+
+    return new_job
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed `attempts` times."""
+
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def claim_next():
+    """Mark the next due job as running and return it, or None if idle."""
+
+    now = datetime.utcnow()
+
+    query = (Job.query
+             .filter(Job.status == 'queued', Job.run_at <= now)
+             .order_by(Job.run_at, Job.id))
+
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    next_job = query.first()
+
+    if next_job is None:
+        db.session.rollback()
+        return None
+
+    claimed = (Job.query
+               .filter(Job.id == next_job.id, Job.status == 'queued')
+               .update({'status': 'running',
+                        'attempts': Job.attempts + 1,
+                        'updated_at': now},
+                       synchronize_session=False))
+    db.session.commit()
+
+    if not claimed:
+        # another worker got there first (SQLite only); look again
+        return claim_next()
+
+    METRICS['claimed'] += 1
+
+    return next_job
+
+
+def run_job(claimed_job):
+    """Run a claimed job and record whether it succeeded, will retry or failed."""
+
+    try:
+        handler = HANDLERS[claimed_job.name]
+        handler(**json.loads(claimed_job.payload))
+
+    except Exception:
+        db.session.rollback()
+
+        claimed_job.last_error = traceback.format_exc()
+        claimed_job.updated_at = datetime.utcnow()
+
+        if claimed_job.attempts >= claimed_job.max_attempts:
+            claimed_job.status = 'failed'
+            METRICS['failed'] += 1
+        else:
+            claimed_job.status = 'queued'
+            claimed_job.run_at = (datetime.utcnow()
+                                  + timedelta(seconds=backoff(claimed_job.attempts)))
+            METRICS['retried'] += 1
+
+        db.session.commit()
+        return False
+
+    claimed_job.status = 'done'
+    # payloads can be large (queued photo bytes); nothing needs them now
+    claimed_job.payload = "{}"
+    claimed_job.updated_at = datetime.utcnow()
+    db.session.commit()
+    METRICS['succeeded'] += 1
+
+    return True
+
+
+def requeue_stale():
+    """Put back jobs left running by a worker that died mid-job.
+
+    A job that has used up its attempts is failed instead, so one that
+    kills its worker every time isn't retried forever.
+    """
+
+    now = datetime.utcnow()
+    stale = (Job.query
+             .filter(Job.status == 'running', Job.updated_at < now - STALE_AFTER))
+
+    failed = (stale
+              .filter(Job.attempts >= Job.max_attempts)
+              .update({'status': 'failed',
+                       'last_error': "worker stopped while running the job",
+                       'updated_at': now},
+                      synchronize_session=False))
+    count = stale.update({'status': 'queued'}, synchronize_session=False)
+    db.session.commit()
+
+    METRICS['failed'] += failed
+
+    return count
+
+
+def purge_finished(older_than=KEEP_FINISHED):
+    """Delete done and failed jobs last touched before `older_than` ago."""
+
+    cutoff = datetime.utcnow() - older_than
+
+    count = (Job.query
+             .filter(Job.status.in_(('done', 'failed')), Job.updated_at < cutoff)
+             .delete(synchronize_session=False))
+    db.session.commit()
+
+    return count
+
+
+def queue_stats():
+    """Number of jobs in each status, e.g. {'queued': 3, 'done': 120}."""
+
+    rows = (db.session.query(Job.status, db.func.count(Job.id))
+            .group_by(Job.status)
+            .all())
+
+    return dict(rows)
+
+
+def run_worker(poll_interval=1.0, report_every=60, burst=False):
+    """Process jobs until interrupted.
+
+    With `burst` the worker exits as soon as the queue is empty instead of
+    sleeping; useful for tests, benchmarks and one-off drains.
+    """
+
+    last_report = time.monotonic()
+    requeue_stale()
+    purge_finished()
+
+    while True:
+        claimed_job = claim_next()
+
+        if claimed_job is not None:
+            run_job(claimed_job)
+        elif burst:
+            return METRICS
+        else:
+            time.sleep(poll_interval)
+
+        if time.monotonic() - last_report >= report_every:
+            requeue_stale()
+            purge_finished()
+            print("jobs:", dict(METRICS), "queue:", queue_stats())
+            last_report = time.monotonic()
@@ -0,0 +1,343 @@
+"""Monthly partitioning and archival of the messages table.
+
+Only the last HOT_DAYS of messages are served by default; anything older is
+still in the database until `archive_cold_messages()` moves whole months
+out to gzipped JSON-lines files, from which `load_archived_messages()`
+reads them back on demand.
+
+Archives go to the S3 bucket (BUCKET) under ARCHIVE_PREFIX, since a
+dyno's own disk is wiped on every restart. Set MESSAGE_ARCHIVE_DIR to keep
+them in a directory instead; only do that if the directory is persistent
+and shared by every process that reads archives. A month's rows are only
+deleted once its archive has been stored.
+
+On PostgreSQL `partition_messages_table()` turns `messages` into a table
+partitioned by month on `timestamp`, so archiving a month is a DETACH +
+DROP of its partition rather than a large DELETE. SQLite has no table
+partitioning; there the table stays as it is and archiving deletes the
+month's rows by timestamp range.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+
+from helpers import ConfigError
+from models import db, Message
+
+HOT_DAYS = int(os.environ.get('MESSAGES_HOT_DAYS', 90))
+
+# unset: archives live in S3
+ARCHIVE_DIR = os.environ.get('MESSAGE_ARCHIVE_DIR')
+ARCHIVE_PREFIX = 'message-archive/'
+
+
+def month_start(day):
+    """First day of the month containing `day`."""
+
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    """First day of the month after `month`."""
+
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def parse_month(value):
+    """Parse "YYYY-MM" to the first day of that month."""
+
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+def hot_cutoff():
+    """Messages sent before this are outside the hot window."""
+
+    return datetime.utcnow() - timedelta(days=HOT_DAYS)
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def is_partitioned():
+    """Is `messages` a partitioned table? (Always False outside PostgreSQL.)"""
+
+    if not is_postgres():
+        return False
+
+    return bool(db.session.execute(db.text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'messages'")).scalar())
+
+
+def partition_name(month):
+    return f"messages_y{month.year}m{month.month:02d}"
+
+
+def create_partition(month):
+    """Create the partition holding `month`'s messages if it doesn't exist."""
+
+    db.session.execute(db.text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+        f"PARTITION OF messages "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"))
+
+
+def ensure_partitions(months_ahead=2):
+    """Make sure this month's and the next few months' partitions exist."""
+
+    if not is_partitioned():
+        return
+
+    month = month_start(date.today())
+    for _ in range(months_ahead + 1):
+        create_partition(month)
+        month = next_month(month)
+
+    db.session.commit()
+
+
+def partition_messages_table():
+    """Convert `messages` into a table partitioned by month (PostgreSQL only).
+
+    Runs in one transaction and holds an exclusive lock on messages while it
+    copies the rows across, so schedule it for a quiet period.
+    """
+
+    if not is_postgres() or is_partitioned():
+        return False
+
+    def execute(sql):
+        return db.session.execute(db.text(sql))
+
+    execute("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE")
+    execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    # free the names the new table's key and indexes take over, so they
+    # match the models and the migrations
+    execute("ALTER TABLE messages_unpartitioned "
+            "RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey")
+    execute("DROP INDEX IF EXISTS ix_messages_listing_id_timestamp, "
+            "ix_messages_to_user_timestamp, ix_messages_from_user, "
+            "ix_messages_timestamp")
+    execute("CREATE TABLE messages (LIKE messages_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (timestamp)")
+    # a partitioned table's primary key has to include the partition key
+    execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey "
+            "PRIMARY KEY (id, timestamp)")
+    execute("ALTER TABLE messages ADD FOREIGN KEY (listing_id) "
+            "REFERENCES listings (id) ON DELETE CASCADE")
+    execute("ALTER TABLE messages ADD FOREIGN KEY (to_user) "
+            "REFERENCES users (username) ON DELETE CASCADE")
+    execute("ALTER TABLE messages ADD FOREIGN KEY (from_user) "
+            "REFERENCES users (username) ON DELETE CASCADE")
+    execute("CREATE INDEX ix_messages_listing_id_timestamp "
+            "ON messages (listing_id, timestamp)")
+    execute("CREATE INDEX ix_messages_to_user_timestamp "
+            "ON messages (to_user, timestamp)")
+    execute("CREATE INDEX ix_messages_from_user ON messages (from_user)")
+    execute("CREATE INDEX ix_messages_timestamp ON messages (timestamp)")
+    # catches rows for months nobody created a partition for yet
+    execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    oldest = execute("SELECT min(timestamp) FROM messages_unpartitioned").scalar()
+    month = month_start(oldest.date() if oldest else date.today())
+    last = next_month(next_month(month_start(date.today())))
+    while month <= last:
+        create_partition(month)
+        month = next_month(month)
+
+    execute("INSERT INTO messages SELECT * FROM messages_unpartitioned")
+    # keep the id sequence when the old table goes away
+    execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    execute("DROP TABLE messages_unpartitioned")
+
+    db.session.commit()
+
+    return True
+
+
+def archive_name(month):
+    return f"messages-{month:%Y-%m}.jsonl.gz"
+
+
+def fetch_archive(month, path):
+    """Copy a month's stored archive to `path`; False if there isn't one."""
+
+    if ARCHIVE_DIR:
+        try:
+            shutil.copyfile(os.path.join(ARCHIVE_DIR, archive_name(month)), path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    if not os.environ.get('BUCKET'):
+        raise ConfigError("Set BUCKET or MESSAGE_ARCHIVE_DIR to archive messages")
+
+    from upload import download_file_from_aws
+
+    return download_file_from_aws(ARCHIVE_PREFIX + archive_name(month), path)
+
+
+def store_archive(month, path):
+    """Save the file at `path` as a month's archive, replacing any earlier one."""
+
+    if ARCHIVE_DIR:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        target = os.path.join(ARCHIVE_DIR, archive_name(month))
+        shutil.copyfile(path, target + ".tmp")
+        os.replace(target + ".tmp", target)
+        return
+
+    if not os.environ.get('BUCKET'):
+        raise ConfigError("Set BUCKET or MESSAGE_ARCHIVE_DIR to archive messages")
+
+    from upload import upload_file_to_aws
+
+    upload_file_to_aws(path, ARCHIVE_PREFIX + archive_name(month))
+
+
+def archive_month(month):
+    """Move one month of messages out of the database into its archive.
+
+    Nothing is deleted unless the archive was stored; if storing fails the
+    error propagates and the month's rows stay where they were. Returns the
+    number of messages archived.
+    """
+
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(next_month(month), datetime.min.time())
+
+    if end > hot_cutoff():
+        raise ValueError(f"{month:%Y-%m} is still inside the hot window")
+
+    name = partition_name(month)
+    has_partition = is_partitioned() and db.session.execute(
+        db.text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+
+    if has_partition:
+        # hold off writes to the month until it's detached below
+        db.session.execute(db.text(f"LOCK TABLE {name} IN SHARE MODE"))
+
+    in_month = (Message.query
+                .filter(Message.timestamp >= start, Message.timestamp < end))
+
+    previous = tempfile.NamedTemporaryFile(suffix=".jsonl.gz", delete=False)
+    updated = tempfile.NamedTemporaryFile(suffix=".jsonl.gz", delete=False)
+    previous.close()
+    updated.close()
+
+    try:
+        had_archive = fetch_archive(month, previous.name)
+        count = 0
+        last_id = None
+
+        # append to what was archived before, in case rows arrived late
+        with gzip.open(updated.name, "wt") as out:
+            if had_archive:
+                with gzip.open(previous.name, "rt") as earlier:
+                    shutil.copyfileobj(earlier, out)
+
+            for message in in_month.order_by(Message.id).yield_per(10_000):
+                out.write(json.dumps(archived_row(message)) + "\n")
+                count += 1
+                last_id = message.id
+
+        if count:
+            store_archive(month, updated.name)
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    finally:
+        os.remove(previous.name)
+        os.remove(updated.name)
+
+    if has_partition:
+        db.session.execute(db.text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        db.session.execute(db.text(f"DROP TABLE {name}"))
+
+    # everything when unpartitioned; stragglers in messages_default otherwise.
+    # Only rows that made it into the archive.
+    if count:
+        in_month.filter(Message.id <= last_id).delete(synchronize_session=False)
+
+    db.session.commit()
+
+    return count
+
+
+def archive_cold_messages():
+    """Archive every whole month that has left the hot window.
+
+    Returns {"YYYY-MM": messages archived}.
+    """
+
+    oldest = db.session.query(db.func.min(Message.timestamp)).scalar()
+    archived = {}
+
+    if oldest is None:
+        return archived
+
+    month = month_start(oldest.date())
+    cutoff = hot_cutoff()
+
+    while datetime.combine(next_month(month), datetime.min.time()) <= cutoff:
+        archived[f"{month:%Y-%m}"] = archive_month(month)
+        month = next_month(month)
+
+    return archived
+
+
+def archived_row(message):
+    """A message as stored in an archive file."""
+
+    return {
+        "id": message.id,
+        "listingId": message.listing_id,
+        "fromUser": message.from_user,
+        "toUser": message.to_user,
+        "body": message.body,
+        "timeStamp": message.timestamp.isoformat()
+    }
+
+
+def load_archived_messages(month, listing_id=None, to_user=None):
+    """Read back a month ("YYYY-MM") of archived messages, filtered like the
+    live routes.
+
+    Messages come back in the same shape as Message.serialize().
+    """
+
+    download = tempfile.NamedTemporaryFile(suffix=".jsonl.gz", delete=False)
+    download.close()
+
+    messages = []
+    seen = set()
+
+    try:
+        if not fetch_archive(parse_month(month), download.name):
+            return []
+
+        with gzip.open(download.name, "rt") as archive:
+            for line in archive:
+                row = json.loads(line)
+                # a month archived twice after an interrupted run repeats rows
+                if row["id"] in seen:
+                    continue
+                seen.add(row["id"])
+                if listing_id is not None and row["listingId"] != listing_id:
+                    continue
+                if to_user is not None and row["toUser"] != to_user:
+                    continue
+                row["timeStamp"] = datetime.fromisoformat(row["timeStamp"])
+                messages.append(row)
+    finally:
+        os.remove(download.name)
+
+    return messages
@@ -0,0 +1,64 @@
+"""index foreign key columns and the message lookups
+
+On PostgreSQL the indexes are built CONCURRENTLY (outside the migration
+transaction) so bookings, listings, messages and images stay writable
+while they build; that includes the (listing_id, timestamp) and
+(to_user, timestamp) indexes behind the message thread and inbox queries.
+A partitioned messages table can't be indexed concurrently, so it gets a
+plain CREATE INDEX.
+
+Revision ID: 17c7e14dc94c
+Revises: 9d0469fc6ed0
+Create Date: 2026-10-19 16:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '17c7e14dc94c'
+down_revision = '9d0469fc6ed0'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_bookings_listing_id', 'bookings', ['listing_id']),
+    ('ix_bookings_guest', 'bookings', ['guest']),
+    ('ix_listings_user_id', 'listings', ['user_id']),
+    ('ix_messages_from_user', 'messages', ['from_user']),
+    ('ix_messages_listing_id_timestamp', 'messages', ['listing_id', 'timestamp']),
+    ('ix_messages_to_user_timestamp', 'messages', ['to_user', 'timestamp']),
+    ('ix_images_listing_id', 'images', ['listing_id']),
+    ('ix_images_user', 'images', ['user']),
+]
+
+
+def is_partitioned(bind, table):
+    if bind.dialect.name != 'postgresql':
+        return False
+
+    return bool(bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table"), {"table": table}).scalar())
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for name, table, columns in INDEXES:
+        if name in {i['name'] for i in inspector.get_indexes(table)}:
+            continue
+
+        if bind.dialect.name == 'postgresql' and not is_partitioned(bind, table):
+            with op.get_context().autocommit_block():
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+        else:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,49 @@
+"""index message timestamps
+
+Archiving selects and deletes a month of messages by timestamp alone;
+without this index that reads the whole table once per month (on SQLite,
+and on PostgreSQL before `flask partition-messages`). Built CONCURRENTLY
+on PostgreSQL unless messages is already partitioned.
+
+Revision ID: 3b8e51c0d2a7
+Revises: 17c7e14dc94c
+Create Date: 2026-10-19 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e51c0d2a7'
+down_revision = '17c7e14dc94c'
+branch_labels = None
+depends_on = None
+
+
+def is_partitioned(bind, table):
+    if bind.dialect.name != 'postgresql':
+        return False
+
+    return bool(bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table"), {"table": table}).scalar())
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    if 'ix_messages_timestamp' in {i['name'] for i in sa.inspect(bind).get_indexes('messages')}:
+        return
+
+    if bind.dialect.name == 'postgresql' and not is_partitioned(bind, 'messages'):
+        with op.get_context().autocommit_block():
+            op.create_index('ix_messages_timestamp', 'messages', ['timestamp'],
+                            postgresql_concurrently=True)
+    else:
+        op.create_index('ix_messages_timestamp', 'messages', ['timestamp'])
+
+
+def downgrade():
+    op.drop_index('ix_messages_timestamp', table_name='messages')
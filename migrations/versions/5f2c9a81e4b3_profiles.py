@@ -0,0 +1,38 @@
+"""profiles
+
+Revision ID: 5f2c9a81e4b3
+Revises: 3b8e51c0d2a7
+Create Date: 2026-10-19 19:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c9a81e4b3'
+down_revision = '3b8e51c0d2a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'profiles' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('profiles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('host', sa.Text(), nullable=False),
+        sa.Column('pid', sa.Integer(), nullable=False),
+        sa.Column('seconds', sa.Integer(), nullable=False),
+        sa.Column('interval_ms', sa.Integer(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('elapsed', sa.Float(), nullable=True),
+        sa.Column('samples', sa.Integer(), nullable=True),
+        sa.Column('collapsed', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('profiles')
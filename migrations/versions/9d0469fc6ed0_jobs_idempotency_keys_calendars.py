@@ -0,0 +1,62 @@
+"""jobs, idempotency keys, listing calendars
+
+Revision ID: 9d0469fc6ed0
+Revises: a63fa0f39d4a
+Create Date: 2026-10-19 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d0469fc6ed0'
+down_revision = 'a63fa0f39d4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'idempotency_keys' not in existing:
+        op.create_table('idempotency_keys',
+            sa.Column('key', sa.Text(), nullable=False),
+            sa.Column('request_hash', sa.Text(), nullable=False),
+            sa.Column('status_code', sa.Integer(), nullable=True),
+            sa.Column('response_body', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('key')
+        )
+
+    if 'jobs' not in existing:
+        op.create_table('jobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.Text(), nullable=False),
+            sa.Column('payload', sa.Text(), nullable=False),
+            sa.Column('status', sa.Text(), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('max_attempts', sa.Integer(), nullable=False),
+            sa.Column('run_at', sa.DateTime(), nullable=False),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_jobs_status_run_at', 'jobs', ['status', 'run_at'])
+
+    if 'listing_calendars' not in existing:
+        op.create_table('listing_calendars',
+            sa.Column('listing_id', sa.Integer(), nullable=False),
+            sa.Column('epoch', sa.Date(), nullable=False),
+            sa.Column('days', sa.LargeBinary(), nullable=False),
+            sa.ForeignKeyConstraint(['listing_id'], ['listings.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('listing_id')
+        )
+
+
+def downgrade():
+    op.drop_table('listing_calendars')
+    op.drop_index('ix_jobs_status_run_at', table_name='jobs')
+    op.drop_table('jobs')
+    op.drop_table('idempotency_keys')
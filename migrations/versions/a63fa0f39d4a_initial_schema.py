@@ -0,0 +1,95 @@
+"""initial schema
+
+The tables as db.create_all() made them before migrations existed; tables
+that are already there are left alone, so existing databases can simply run
+`flask db upgrade`.
+
+Revision ID: a63fa0f39d4a
+Revises: 
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a63fa0f39d4a'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'users' not in existing:
+        op.create_table('users',
+            sa.Column('username', sa.Text(), nullable=False),
+            sa.Column('first_name', sa.Text(), nullable=False),
+            sa.Column('last_name', sa.Text(), nullable=False),
+            sa.Column('email', sa.Text(), nullable=False),
+            sa.Column('image_url', sa.Text(), nullable=False),
+            sa.Column('location', sa.Text(), nullable=True),
+            sa.Column('password', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('username'),
+            sa.UniqueConstraint('email')
+        )
+
+    if 'listings' not in existing:
+        op.create_table('listings',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.Text(), nullable=False),
+            sa.Column('description', sa.Text(), nullable=False),
+            sa.Column('location', sa.Text(), nullable=False),
+            sa.Column('type', sa.Text(), nullable=False),
+            sa.Column('price_per_night', sa.Text(), nullable=False),
+            sa.Column('user_id', sa.Text(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['users.username'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'bookings' not in existing:
+        op.create_table('bookings',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('listing_id', sa.Integer(), nullable=False),
+            sa.Column('start_date', sa.Text(), nullable=False),
+            sa.Column('end_date', sa.Text(), nullable=False),
+            sa.Column('guest', sa.Text(), nullable=False),
+            sa.ForeignKeyConstraint(['guest'], ['users.username'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['listing_id'], ['listings.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'messages' not in existing:
+        op.create_table('messages',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('listing_id', sa.Integer(), nullable=False),
+            sa.Column('to_user', sa.Text(), nullable=False),
+            sa.Column('from_user', sa.Text(), nullable=False),
+            sa.Column('body', sa.Text(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['from_user'], ['users.username'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['listing_id'], ['listings.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['to_user'], ['users.username'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'images' not in existing:
+        op.create_table('images',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('listing_id', sa.Integer(), nullable=False),
+            sa.Column('user', sa.Text(), nullable=False),
+            sa.Column('image_url', sa.Text(), nullable=False),
+            sa.ForeignKeyConstraint(['listing_id'], ['listings.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['user'], ['users.username'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('images')
+    op.drop_table('messages')
+    op.drop_table('bookings')
+    op.drop_table('listings')
+    op.drop_table('users')
@@ -1,14 +1,24 @@
 """SQLAlchemy models for ShareBnb."""
 
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 
-bcrypt = Bcrypt()
+from schemas import MAX_BOOKING_NIGHTS
+
 db = SQLAlchemy()
 
 
+@lru_cache(maxsize=None)
+def get_bcrypt():
+    """Return the shared Bcrypt helper, importing bcrypt on first use."""
+
+    from flask_bcrypt import Bcrypt
+
+    return Bcrypt()
+
+
 class Booking(db.Model):
     """booking in the system."""
 
@@ -23,6 +33,7 @@ class Booking(db.Model):
         db.Integer,
         db.ForeignKey('listings.id', ondelete='CASCADE'),
         nullable=False,
+        index=True,
     )
 
     start_date = db.Column(
@@ -38,7 +49,8 @@ class Booking(db.Model):
     guest = db.Column(
         db.Text,
         db.ForeignKey('users.username', ondelete='CASCADE'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
     def __repr__(self):
@@ -55,10 +67,85 @@ class Booking(db.Model):
             guest=guest
         )
 
+        calendar = ListingCalendar.for_listing(listing_id, lock=True)
+        calendar.mark(start_date, end_date, booked=True)
+
         db.session.add(booking)
 
         return booking
 
+    @classmethod
+    def itinerary(cls, guest, when="upcoming", limit=20, offset=0):
+        """A guest's bookings with a summary of each listing, in one query.
+
+        `when` is "upcoming" (not yet checked out, soonest first), "past"
+        (most recent first) or "all". Each row carries the listing's first
+        image so the client doesn't need to fetch listings one by one.
+        """
+
+        primary_image = (db.session.query(Image.image_url)
+                         .filter(Image.listing_id == Listing.id)
+                         .order_by(Image.id)
+                         .limit(1)
+                         .correlate(Listing)
+                         .scalar_subquery())
+
+        query = (db.session.query(cls, Listing.title, Listing.location,
+                                  Listing.type, Listing.price_per_night,
+                                  primary_image.label('image_url'))
+                 .join(Listing, cls.listing_id == Listing.id)
+                 .filter(cls.guest == guest))
+
+        today = date.today().isoformat()
+
+        if when == "upcoming":
+            query = query.filter(cls.end_date >= today).order_by(cls.start_date, cls.id)
+        elif when == "past":
+            query = query.filter(cls.end_date < today).order_by(cls.start_date.desc(), cls.id.desc())
+        else:
+            query = query.order_by(cls.start_date, cls.id)
+
+        rows = query.limit(limit).offset(offset).all()
+
+        return [
+            {**booking.serialize(),
+             "listing": {
+                 "id": booking.listing_id,
+                 "title": title,
+                 "location": location,
+                 "type": type,
+                 "pricePerNight": price_per_night,
+                 "imageUrl": image_url
+             }}
+            for booking, title, location, type, price_per_night, image_url in rows
+        ]
+
+    def calendar_dates(self):
+        """(start, end) as dates, or None for a booking the calendar skips:
+        one from before dates were validated that is malformed or years long.
+        """
+
+        try:
+            start, end = as_date(self.start_date), as_date(self.end_date)
+        except ValueError:
+            return None
+
+        if not 0 < (end - start).days <= MAX_BOOKING_NIGHTS:
+            return None
+
+        return start, end
+
+    def cancel(self):
+        """Delete this booking and free its days on the listing's calendar."""
+
+        dates = self.calendar_dates()
+
+        if dates is not None:
+            calendar = ListingCalendar.for_listing(self.listing_id, lock=True)
+            calendar.mark(*dates, booked=False)
+
+        db.session.delete(self)
+
     def serialize(self):
         """ Serialize to dictionary """
 
@@ -144,7 +231,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = get_bcrypt().generate_password_hash(password).decode('UTF-8')
 
         user = User(
             username=username,
@@ -172,7 +259,7 @@ class User(db.Model):
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = get_bcrypt().check_password_hash(user.password, password)
             if is_auth:
                 return user
 
@@ -231,16 +318,24 @@ class Listing(db.Model):
     user_id = db.Column(
         db.Text,
         db.ForeignKey('users.username', ondelete='CASCADE'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
+    # dynamic: a query, so callers filter to the window they need instead of
+    # loading the listing's whole message history
     messages = db.relationship('Message',
                                cascade='all, delete',
+                               lazy='dynamic',
                                order_by='Message.timestamp.desc()')
 
     images = db.relationship('Image',
                              cascade='all, delete')
 
+    calendar = db.relationship('ListingCalendar',
+                               cascade='all, delete',
+                               uselist=False)
+
     def __repr__(self):
         return f"<Listing #{self.id}, {self.title}, {self.description}, {self.location}, {self.type}, {self.price_per_night}, {self.user_id}>"
 
@@ -301,7 +396,8 @@ class Message(db.Model):
     from_user = db.Column(
         db.Text,
         db.ForeignKey('users.username', ondelete='CASCADE'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
     body = db.Column(
@@ -313,6 +409,12 @@ class Message(db.Model):
         db.DateTime,
         nullable=False,
         default=datetime.utcnow,
+        index=True,
+    )
+
+    __table_args__ = (
+        db.Index('ix_messages_listing_id_timestamp', 'listing_id', 'timestamp'),
+        db.Index('ix_messages_to_user_timestamp', 'to_user', 'timestamp'),
     )
 
     def __repr__(self):
@@ -360,12 +462,14 @@ class Image(db.Model):
         db.Integer,
         db.ForeignKey('listings.id', ondelete='CASCADE'),
         nullable=False,
+        index=True,
     )
 
     user = db.Column(
         db.Text,
         db.ForeignKey('users.username', ondelete='CASCADE'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
     image_url = db.Column(
@@ -396,6 +500,384 @@ class Image(db.Model):
         db.session.add(image)
 
 
+class ListingCalendar(db.Model):
+    """Booked nights of a listing, stored as one bit per day.
+
+    Bit i of `days` is set when the night starting on `epoch + i days` is
+    booked, so calendar and availability checks cost O(days asked about)
+    rather than a scan of the listing's bookings. Days outside the bitmap
+    are free.
+    """
+
+    __tablename__ = 'listing_calendars'
+
+    listing_id = db.Column(
+        db.Integer,
+        db.ForeignKey('listings.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    epoch = db.Column(
+        db.Date,
+        nullable=False
+    )
+
+    days = db.Column(
+        db.LargeBinary,
+        nullable=False,
+        default=b"",
+    )
+
+    def __repr__(self):
+        return f"<ListingCalendar Listing id: {self.listing_id}, From: {self.epoch}, Days: {len(self.days) * 8}>"
+
+    @classmethod
+    def for_listing(cls, listing_id, lock=False):
+        """Get a listing's calendar, building it from its bookings if missing.
+
+        With `lock`, the row is locked (FOR UPDATE) until the transaction ends,
+        so concurrent bookings of the same listing are checked one at a time.
+        """
+
+        query = cls.query.filter_by(listing_id=listing_id)
+        if lock:
+            query = query.with_for_update()
+
+        calendar = query.first()
+
+        if calendar is None:
+            built = cls(listing_id=listing_id,
+                        epoch=date.today().replace(day=1), days=b"")
+            for booking in Booking.query.filter_by(listing_id=listing_id):
+                dates = booking.calendar_dates()
+                if dates is not None:
+                    built.mark(*dates, booked=True)
+
+            # a concurrent first read of the same listing may insert it first
+            db.session.execute(
+                insert_ignoring_conflicts(cls.__table__)
+                .values(listing_id=listing_id, epoch=built.epoch, days=built.days))
+            calendar = query.one()
+
+        return calendar
+
+    @classmethod
+    def for_listings(cls, listing_ids):
+        """Calendars for many listings, loaded with one query."""
+
+        found = {c.listing_id: c for c in
+                 cls.query.filter(cls.listing_id.in_(listing_ids)).all()}
+
+        return [found.get(id) or cls.for_listing(id) for id in listing_ids]
+
+    def mark(self, start, end, booked):
+        """Set (or clear) the nights from `start` up to, not including, `end`."""
+
+        start, end = as_date(start), as_date(end)
+
+        if start < self.epoch:
+            # grow backwards a whole byte (8 days) at a time
+            shift = -(-(self.epoch - start).days // 8)
+            self.epoch -= timedelta(days=shift * 8)
+            self.days = bytes(shift) + self.days
+
+        days = bytearray(self.days)
+        last = (end - self.epoch).days - 1
+        if last >= len(days) * 8:
+            days.extend(bytes(last // 8 + 1 - len(days)))
+
+        for i in range((start - self.epoch).days, last + 1):
+            if booked:
+                days[i >> 3] |= 1 << (i & 7)
+            else:
+                days[i >> 3] &= ~(1 << (i & 7))
+
+        self.days = bytes(days)
+
+    def booked_days(self, start, end):
+        """List of booked flags for each day from `start` up to `end`."""
+
+        start, end = as_date(start), as_date(end)
+        days = self.days
+        size = len(days) * 8
+        offset = (start - self.epoch).days
+
+        return [0 <= i < size and bool(days[i >> 3] & (1 << (i & 7)))
+                for i in range(offset, offset + (end - start).days)]
+
+    def is_free(self, start, end):
+        """Is every night from `start` up to `end` unbooked?"""
+
+        return not any(self.booked_days(start, end))
+
+    def serialize(self, start, end):
+        """ Serialize the days from `start` up to `end` to dictionary """
+
+        start = as_date(start)
+        booked = self.booked_days(start, end)
+
+        return {
+            "listingId": self.listing_id,
+            "free": not any(booked),
+            "days": [{"date": (start + timedelta(days=i)).isoformat(),
+                      "booked": b}
+                     for i, b in enumerate(booked)]
+        }
+
+
+def insert_ignoring_conflicts(table):
+    """INSERT that does nothing when the row's key already exists."""
+
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    return insert(table).on_conflict_do_nothing()
+
+
+def as_date(value):
+    """Accept a date or a YYYY-MM-DD string (how booking dates are stored)."""
+
+    if isinstance(value, date):
+        return value
+
+    return date.fromisoformat(value[:10])
+
+
+class IdempotencyKey(db.Model):
+    """Response recorded for a client-supplied Idempotency-Key."""
+
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    request_hash = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    status_code = db.Column(
+        db.Integer,
+    )
+
+    response_body = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    TTL = timedelta(hours=24)
+
+    # an in-flight key older than this belongs to a request whose worker died
+    LEASE = timedelta(minutes=5)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key}, Status: {self.status_code}>"
+
+    @property
+    def is_expired(self):
+        """Has this key outlived its TTL?"""
+
+        return self.created_at < datetime.utcnow() - self.TTL
+
+    @property
+    def is_abandoned(self):
+        """Was this key claimed but never finished within the lease?"""
+
+        return (self.status_code is None
+                and self.created_at < datetime.utcnow() - self.LEASE)
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete every key older than the TTL; returns how many were removed."""
+
+        cutoff = datetime.utcnow() - cls.TTL
+
+        return cls.query.filter(cls.created_at < cutoff).delete()
+
+
+class Job(db.Model):
+    """Background job waiting for (or processed by) the worker."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+        default="{}",
+    )
+
+    # queued -> running -> done, or back to queued for a retry, or failed
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default="queued",
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}, {self.name}, {self.status}, Attempts: {self.attempts}>"
+
+    def serialize(self):
+        """ Serialize to dictionary """
+
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "attempts": self.attempts,
+            "runAt": self.run_at,
+            "lastError": self.last_error
+        }
+
+
+class Profile(db.Model):
+    """A run of the stack sampler, stored so any worker can serve it."""
+
+    __tablename__ = 'profiles'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # the worker that was sampled
+    host = db.Column(
+        db.Text,
+        nullable=False
+    )
+
+    pid = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    seconds = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    interval_ms = db.Column(
+        db.Integer,
+        nullable=False
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    elapsed = db.Column(
+        db.Float,
+    )
+
+    samples = db.Column(
+        db.Integer,
+    )
+
+    # collapsed stacks; NULL while the sampler is still running
+    collapsed = db.Column(
+        db.Text,
+    )
+
+    # only the most recent profiles are kept
+    KEEP = 20
+
+    # a run still unfinished this long after its end lost its worker
+    GRACE = timedelta(seconds=30)
+
+    def __repr__(self):
+        return f"<Profile #{self.id}, {self.host}:{self.pid}, Seconds: {self.seconds}>"
+
+    @property
+    def is_running(self):
+        """Is the sampler still expected to finish this run?"""
+
+        deadline = self.started_at + timedelta(seconds=self.seconds) + self.GRACE
+
+        return self.collapsed is None and datetime.utcnow() < deadline
+
+    def serialize(self):
+        """ Serialize to dictionary """
+
+        return {
+            "id": self.id,
+            "host": self.host,
+            "pid": self.pid,
+            "seconds": self.seconds,
+            "intervalMs": self.interval_ms,
+            "startedAt": self.started_at,
+            "elapsed": self.elapsed,
+            "samples": self.samples,
+            "running": self.is_running
+        }
+
+    @classmethod
+    def purge_old(cls):
+        """Delete all but the newest KEEP profiles; returns how many went."""
+
+        keep = db.session.query(cls.id).order_by(cls.id.desc()).limit(cls.KEEP)
+
+        return (cls.query.filter(cls.id.notin_(keep.subquery().select()))
+                .delete(synchronize_session=False))
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
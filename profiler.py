@@ -0,0 +1,217 @@
+"""On-demand profiling of a live worker.
+
+Two tools, both off unless asked for:
+
+- A statistical sampler (`start_sampling`) that runs in a background thread
+  of the current worker for a few seconds, snapshotting every other
+  thread's stack with sys._current_frames() at a fixed interval. Nothing
+  runs between samples, so the cost is one stack walk per thread per
+  interval. When it finishes it hands its collapsed stacks to an
+  `on_finish` callback; the app stores them in the profiles table, so
+  with several gunicorn workers the result can be fetched from whichever
+  worker serves the next request. `speedscope()` turns them into
+  speedscope JSON.
+
+- Per-request cProfile, enabled with PROFILE_SAMPLE_RATE > 0: an admin
+  request carrying `X-Profile: 1` is profiled with that probability and the
+  top PROFILE_TOP functions by cumulative time come back in the response
+  itself, as pstats text under a "profile" key. With the rate at 0 (the
+  default) the request hooks are never registered.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+from helpers import verify_token
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 40))
+
+MAX_SECONDS = 120
+
+_lock = threading.Lock()
+_running = None
+
+
+def admin_usernames():
+    return {u.strip().lower()
+            for u in os.environ.get('ADMIN_USERNAMES', '').split(',') if u.strip()}
+
+
+def is_admin(token):
+    """Does `token` belong to one of the ADMIN_USERNAMES?"""
+
+    try:
+        username = verify_token(token)['username']
+    except Exception:
+        return False
+
+    return username in admin_usernames()
+
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Counts how often each distinct stack is seen across the worker's threads."""
+
+    def __init__(self, seconds, interval, on_finish=None):
+        self.seconds = seconds
+        self.interval = interval
+        self.on_finish = on_finish
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0
+        self.thread = threading.Thread(target=self.run, name='profiler',
+                                       daemon=True)
+
+    def run(self):
+        global _running
+
+        own_id = threading.get_ident()
+        self.started_at = time.time()
+        start = time.perf_counter()
+        deadline = start + self.seconds
+
+        try:
+            while time.perf_counter() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame_name(frame.f_code))
+                        frame = frame.f_back
+
+                    self.counts[";".join(reversed(stack))] += 1
+
+                self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            with _lock:
+                _running = None
+
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed-stack format, one "a;b;c count" per line."""
+
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self.counts.most_common())
+
+
+def speedscope(collapsed, interval, name):
+    """Collapsed stacks, sampled every `interval` seconds, as a speedscope
+    "sampled" profile."""
+
+    frames = []
+    index = {}
+    samples = []
+    weights = []
+
+    for line in collapsed.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        sample = []
+        for frame in stack.split(";"):
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({"name": frame})
+            sample.append(index[frame])
+        samples.append(sample)
+        weights.append(int(count) * interval)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights
+        }],
+        "exporter": "sharebnb profiler"
+    }
+
+
+def start_sampling(seconds, interval=0.01, on_finish=None):
+    """Start sampling this worker in the background; None if already running.
+
+    `on_finish(sampler)` is called from the sampling thread once it stops.
+    """
+
+    global _running
+
+    with _lock:
+        if _running is not None:
+            return None
+
+        _running = Sampler(min(seconds, MAX_SECONDS), interval, on_finish)
+        _running.thread.start()
+
+        return _running
+
+
+def profile_text(profile, limit=None):
+    """pstats report of a finished cProfile, top `limit` by cumulative time."""
+
+    out = io.StringIO()
+    (pstats.Stats(profile, stream=out)
+     .sort_stats('cumulative')
+     .print_stats(limit or PROFILE_TOP))
+
+    return out.getvalue()
+
+
+def init_request_profiling(app):
+    """Register the per-request cProfile hooks if PROFILE_SAMPLE_RATE > 0."""
+
+    if PROFILE_SAMPLE_RATE <= 0:
+        return
+
+    @app.before_request
+    def start_request_profile():
+        if (request.headers.get('X-Profile') == '1'
+                and random.random() < PROFILE_SAMPLE_RATE
+                and is_admin(request.headers.get('token'))):
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    @app.after_request
+    def save_request_profile(response):
+        profile = g.pop('profile', None)
+
+        if profile is not None:
+            profile.disable()
+            body = response.get_json(silent=True)
+
+            # every route answers with a JSON object; leave anything else be
+            if isinstance(body, dict):
+                body["profile"] = profile_text(profile)
+                response.set_data(json.dumps(body))
+
+        return response
+
+    @app.teardown_request
+    def stop_request_profile(exc):
+        profile = g.pop('profile', None)
+
+        if profile is not None:
+            profile.disable()
@@ -0,0 +1,325 @@
+"""Request payload validation for the JSON API.
+
+Each schema is built once at import time; validating a payload is a single
+pass over its fields that checks and coerces every value, so routes get
+back ready-to-use Python values (ints, dates, prices) plus an errors dict
+shaped like WTForms' ``form.errors``.
+"""
+
+import re
+from collections.abc import Mapping
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def to_text(value):
+    """Coerce to a stripped string."""
+
+    if not isinstance(value, str):
+        raise ValueError("Not a valid string.")
+
+    return value.strip()
+
+
+def to_secret(value):
+    """Coerce to a string, keeping surrounding whitespace (passwords)."""
+
+    if not isinstance(value, str):
+        raise ValueError("Not a valid string.")
+
+    return value
+
+
+def to_integer(value):
+    """Coerce to an int (accepts ints and digit strings)."""
+
+    if isinstance(value, bool):
+        raise ValueError("Not a valid integer value.")
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Not a valid integer value.")
+
+
+def to_date(value):
+    """Coerce a YYYY-MM-DD string (or a full ISO datetime) to a date."""
+
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        return datetime.fromisoformat(value).date()
+    except (TypeError, ValueError):
+        raise ValueError("Not a valid date value (expected YYYY-MM-DD).")
+
+
+MAX_PRICE = Decimal("1000000")
+
+
+def to_price(value):
+    """Coerce to a price string with two decimal places, 0 to MAX_PRICE."""
+
+    try:
+        price = Decimal(str(value).strip().lstrip("$"))
+    except InvalidOperation:
+        raise ValueError("Not a valid price.")
+
+    if not price.is_finite() or not 0 <= price <= MAX_PRICE:
+        raise ValueError(f"Price must be between 0 and {MAX_PRICE}.")
+
+    try:
+        return str(price.quantize(Decimal("0.01")))
+    except InvalidOperation:
+        raise ValueError("Not a valid price.")
+
+
+def to_email(value):
+    """Coerce to a stripped string that looks like an email address."""
+
+    value = to_text(value)
+
+    if not EMAIL_RE.match(value):
+        raise ValueError("Invalid email address.")
+
+    return value
+
+
+class Field:
+    """A single field: how to coerce it and whether it must be present."""
+
+    def __init__(self, coerce=to_text, required=True, min_length=None):
+        self.coerce = coerce
+        self.required = required
+        self.min_length = min_length
+
+
+class Schema:
+    """A compiled set of fields.
+
+    ``check`` is an optional callable run on the cleaned values once every
+    field is valid; it returns a dict of extra errors (e.g. cross-field rules).
+    """
+
+    def __init__(self, check=None, **fields):
+        self.fields = tuple(
+            (name, f.coerce, f.required, f.min_length)
+            for name, f in fields.items()
+        )
+        self.check = check
+
+    def validate(self, data):
+        """Return ``(cleaned, errors)`` for a JSON dict or form MultiDict."""
+
+        data = data or {}
+
+        if not isinstance(data, Mapping):
+            return {}, {"body": ["Expected a JSON object."]}
+        cleaned = {}
+        errors = {}
+
+        for name, coerce, required, min_length in self.fields:
+            value = data.get(name)
+
+            if value is None or value == "":
+                if required:
+                    errors[name] = ["This field is required."]
+                continue
+
+            try:
+                value = coerce(value)
+            except ValueError as e:
+                errors[name] = [str(e)]
+                continue
+
+            if required and value == "":
+                errors[name] = ["This field is required."]
+            elif min_length and len(value) < min_length:
+                errors[name] = [
+                    f"Field must be at least {min_length} characters long."]
+            else:
+                cleaned[name] = value
+
+        if not errors and self.check:
+            errors = self.check(cleaned)
+
+        return cleaned, errors
+
+
+MAX_BOOKING_NIGHTS = 365
+BOOKING_WINDOW_DAYS = 730     # how far ahead a stay may start
+
+
+def check_booking_dates(cleaned):
+    """A booking must end after it starts, start within the booking window
+    (from yesterday, for guests behind UTC) and last at most a year."""
+
+    start, end = cleaned["start_date"], cleaned["end_date"]
+    today = date.today()
+
+    if end <= start:
+        return {"end_date": ["End date must be after start date."]}
+    if not (today - timedelta(days=1) <= start
+            <= today + timedelta(days=BOOKING_WINDOW_DAYS)):
+        return {"start_date": [
+            f"Start date must be within the next {BOOKING_WINDOW_DAYS} days."]}
+    if (end - start).days > MAX_BOOKING_NIGHTS:
+        return {"end_date": [
+            f"A booking can't be longer than {MAX_BOOKING_NIGHTS} nights."]}
+
+    return {}
+
+
+def to_choice(*choices):
+    """Build a coercer that only accepts one of `choices`."""
+
+    def coerce(value):
+        if value not in choices:
+            raise ValueError(f"Not a valid choice (one of {', '.join(choices)}).")
+        return value
+
+    return coerce
+
+
+def to_month(value):
+    """Validate a YYYY-MM month string."""
+
+    if not isinstance(value, str) or not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", value):
+        raise ValueError("Not a valid month (expected YYYY-MM).")
+
+    return value
+
+
+def to_flag(value):
+    """Coerce a query-string flag ("1", "true", "0", "false") to a bool."""
+
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+
+    raise ValueError("Not a valid flag (expected true or false).")
+
+
+def to_id_list(value):
+    """Coerce a comma-separated string of ids ("1,2,3") to a list of ints."""
+
+    try:
+        ids = [int(v) for v in value.split(",") if v.strip()]
+    except (AttributeError, ValueError):
+        raise ValueError("Not a valid list of ids.")
+
+    if not ids:
+        raise ValueError("Not a valid list of ids.")
+
+    return ids
+
+
+CALENDAR_DEFAULT_DAYS = 30
+
+
+def calendar_range_check(max_days):
+    """Build a check that fills in a calendar request's dates and caps them.
+
+    `from` defaults to today and `to` to CALENDAR_DEFAULT_DAYS later; both
+    are inclusive, and the range may cover at most `max_days` days.
+    """
+
+    def check(cleaned):
+        try:
+            start = cleaned.setdefault("from", date.today())
+            end = cleaned.setdefault(
+                "to", start + timedelta(days=CALENDAR_DEFAULT_DAYS - 1))
+            # the range is served end-exclusive, so `to` + 1 has to exist
+            end + timedelta(days=1)
+        except OverflowError:
+            return {"to": ["Date is out of range."]}
+
+        if end < start:
+            return {"to": ["End date must not be before start date."]}
+        if (end - start).days + 1 > max_days:
+            return {"to": [f"Date range can't be longer than {max_days} days."]}
+
+        return {}
+
+    return check
+
+
+ListingSchema = Schema(
+    title=Field(),
+    description=Field(),
+    location=Field(),
+    price_per_night=Field(to_price),
+    type=Field(),
+    image_url=Field(required=False),
+)
+
+BookingSchema = Schema(
+    check=check_booking_dates,
+    start_date=Field(to_date),
+    end_date=Field(to_date),
+    listing_id=Field(to_integer),
+)
+
+MessageSchema = Schema(
+    to_user=Field(),
+    body=Field(),
+)
+
+UserAddSchema = Schema(
+    username=Field(),
+    first_name=Field(),
+    last_name=Field(),
+    email=Field(to_email),
+    password=Field(to_secret, min_length=6),
+    image_url=Field(required=False),
+)
+
+LoginSchema = Schema(
+    username=Field(),
+    password=Field(to_secret, min_length=6),
+)
+
+CalendarSchema = Schema(
+    check=calendar_range_check(max_days=731),
+    **{"from": Field(to_date, required=False),
+       "to": Field(to_date, required=False)},
+)
+
+# up to 100 listings at once, so a shorter range than for one listing
+CalendarBatchSchema = Schema(
+    check=calendar_range_check(max_days=92),
+    **{"ids": Field(to_id_list),
+       "from": Field(to_date, required=False),
+       "to": Field(to_date, required=False)},
+)
+
+ListingIdsSchema = Schema(
+    ids=Field(to_id_list, required=False),
+)
+
+ItinerarySchema = Schema(
+    view=Field(to_choice("bookings", "itinerary"), required=False),
+    when=Field(to_choice("upcoming", "past", "all"), required=False),
+    page=Field(to_integer, required=False),
+    per_page=Field(to_integer, required=False),
+)
+
+MessageHistorySchema = Schema(
+    all=Field(to_flag, required=False),
+    archived=Field(to_month, required=False),
+)
+
+ProfileStartSchema = Schema(
+    seconds=Field(to_integer, required=False),
+    interval_ms=Field(to_integer, required=False),
+)
+
+ProfileResultSchema = Schema(
+    id=Field(to_integer, required=False),
+    format=Field(to_choice("speedscope", "collapsed"), required=False),
+)
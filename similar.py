@@ -0,0 +1,402 @@
+"""Precomputed "similar listings" index.
+
+Each listing's title, description, type and location are turned into a
+sparse TF-IDF vector over hashed terms, L2-normalised, so the similarity
+of two listings is the exact cosine of their TF-IDF vectors.
+
+An index build is a generation directory under SIMILAR_INDEX_DIR; the
+`current` symlink points at the live one and is swapped atomically by
+`rebuild()`. Each generation holds:
+
+    ids.i64          listing id of each row (-1 once removed)
+    offsets.i64      start of each hash bucket's postings, HASH_BUCKETS + 1
+    rows.i32         postings: the rows containing each bucket...
+    weights.f32      ...and that bucket's weight in each of those rows
+    df.i64           document frequency per hash bucket; the last slot holds
+                     the number of documents indexed
+
+A lookup only touches the postings of the query listing's own terms.
+Listings added since the build are appended, one sparse row at a time, to
+delta_ids.i64 / delta_lengths.i32 / delta_buckets.i32 / delta_weights.f32,
+which are scanned in full; the next rebuild folds them in.
+
+Readers memory-map the files and pick up appends, removals and new
+generations on their next query. Writers serialise on an flock'd lock file.
+
+Building reads every listing, which takes minutes for a large table, so
+it never happens inside a request: `start_background_builds()` builds the
+index in a thread at startup and rebuilds it every SIMILAR_REBUILD_SECONDS,
+and lookups return [] until the first build is in place (with
+SIMILAR_REBUILD_SECONDS=0 only `flask rebuild-similar` builds it). The directory is
+local to the machine (on Heroku each dyno's own disk, empty at boot), so
+each dyno builds its copy; the periodic rebuild is also what brings in
+listings added or deleted through other dynos, and callers should drop
+ids that no longer exist.
+"""
+
+import fcntl
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from math import log
+from zlib import crc32
+
+import numpy as np
+
+HASH_BUCKETS = 2 ** 18
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it of on or the this to "
+    "with".split())
+
+INDEX_DIR = os.environ.get(
+    'SIMILAR_INDEX_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'similar'),
+)
+REBUILD_SECONDS = int(os.environ.get('SIMILAR_REBUILD_SECONDS', 6 * 60 * 60))
+
+
+def listing_terms(listing):
+    """Term counts for the text fields of a listing."""
+
+    text = " ".join((listing.title, listing.description,
+                     listing.type, listing.location)).lower()
+
+    return Counter(t for t in TOKEN_RE.findall(text) if t not in STOP_WORDS)
+
+
+def term_bucket(term):
+    return crc32(term.encode()) % HASH_BUCKETS
+
+
+def weigh(terms, df, n_docs):
+    """A listing's L2-normalised TF-IDF weights as (buckets, weights) arrays."""
+
+    by_bucket = Counter()
+
+    for term, tf in terms.items():
+        bucket = term_bucket(term)
+        by_bucket[bucket] += (1 + log(tf)) * (log((1 + n_docs) / (1 + df[bucket])) + 1)
+
+    buckets = np.fromiter(by_bucket.keys(), dtype=np.int32, count=len(by_bucket))
+    weights = np.fromiter(by_bucket.values(), dtype=np.float32, count=len(by_bucket))
+    norm = np.linalg.norm(weights)
+
+    return buckets, weights / norm if norm else weights
+
+
+def load(path, dtype, shape=None):
+    """Memory-map a file, or an empty array if it's empty."""
+
+    size = os.path.getsize(path)
+
+    if not size:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class SimilarityIndex:
+    """Memory-mapped sparse TF-IDF rows with top-k cosine lookups."""
+
+    def __init__(self, path=INDEX_DIR):
+        self.path = path
+        self.generation = None
+        self._version = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _current(self):
+        """Directory of the live generation, or None before the first build."""
+
+        try:
+            return os.path.join(self.path, os.readlink(self._file('current')))
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        """(Re)map the files if another process has changed or replaced them."""
+
+        generation = self._current()
+
+        if generation is None:
+            self.generation = self._version = None
+            return
+
+        def stat(name):
+            s = os.stat(os.path.join(generation, name))
+            return s.st_ino, s.st_mtime_ns, s.st_size
+
+        version = (generation, stat('ids.i64'), stat('delta_ids.i64'))
+
+        if version == self._version:
+            return
+
+        def file(name):
+            return os.path.join(generation, name)
+
+        self.ids = load(file('ids.i64'), np.int64)
+        self.offsets = np.fromfile(file('offsets.i64'), dtype=np.int64)
+        self.rows = load(file('rows.i32'), np.int32)
+        self.weights = load(file('weights.f32'), np.float32)
+
+        # delta_ids is written last, so every row it counts is complete
+        self.delta_ids = load(file('delta_ids.i64'), np.int64)
+        n_delta = len(self.delta_ids)
+        lengths = np.fromfile(file('delta_lengths.i32'), dtype=np.int32)[:n_delta]
+        n_entries = int(lengths.sum())
+        self.delta_rows = np.repeat(np.arange(n_delta), lengths)
+        self.delta_buckets = load(file('delta_buckets.i32'), np.int32)[:n_entries]
+        self.delta_weights = load(file('delta_weights.f32'), np.float32)[:n_entries]
+
+        self.generation = generation
+        self._version = version
+
+    def _read_df(self, generation):
+        return np.fromfile(os.path.join(generation, 'df.i64'), dtype=np.int64)
+
+    def _locked(self, name='lock', blocking=True):
+        """Hold an flock on `name`; None if `blocking` is off and it's taken."""
+
+        os.makedirs(self.path, exist_ok=True)
+        lock = open(self._file(name), 'w')
+
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock.close()
+            return None
+
+        return lock
+
+    def add(self, listing):
+        """Index a newly committed listing (a no-op until the first build)."""
+
+        terms = listing_terms(listing)
+
+        with self._locked():
+            generation = self._current()
+            if generation is None:
+                return
+
+            df = self._read_df(generation)
+            for term in terms:
+                df[term_bucket(term)] += 1
+            df[HASH_BUCKETS] += 1
+
+            buckets, weights = weigh(terms, df, df[HASH_BUCKETS])
+
+            def append(name, data):
+                with open(os.path.join(generation, name), 'ab') as f:
+                    f.write(data.tobytes())
+
+            # ids last: readers size the delta from delta_ids.i64, so they
+            # never see an id whose terms aren't there yet
+            append('delta_buckets.i32', buckets)
+            append('delta_weights.f32', weights)
+            append('delta_lengths.i32', np.array([len(buckets)], dtype=np.int32))
+            append('delta_ids.i64', np.array([listing.id], dtype=np.int64))
+
+            df.tofile(os.path.join(generation, 'df.i64.tmp'))
+            os.replace(os.path.join(generation, 'df.i64.tmp'),
+                       os.path.join(generation, 'df.i64'))
+
+    def remove(self, listing_id):
+        """Drop a deleted listing from the index."""
+
+        with self._locked():
+            generation = self._current()
+            if generation is None:
+                return
+
+            for name in ('ids.i64', 'delta_ids.i64'):
+                path = os.path.join(generation, name)
+                rows = np.flatnonzero(np.fromfile(path, dtype=np.int64) == listing_id)
+
+                if len(rows):
+                    with open(path, 'r+b') as f:
+                        for row in rows:
+                            f.seek(int(row) * 8)
+                            f.write(np.int64(-1).tobytes())
+
+    def rebuild(self, listings):
+        """Build a new generation from `listings`, with fresh IDF, and swap it in.
+
+        Slow for a large table: call it from a background thread or the
+        CLI, never from a request.
+        """
+
+        listings = list(listings)
+        all_terms = [listing_terms(l) for l in listings]
+
+        df = np.zeros(HASH_BUCKETS + 1, dtype=np.int64)
+        for terms in all_terms:
+            for term in terms:
+                df[term_bucket(term)] += 1
+        df[HASH_BUCKETS] = len(listings)
+
+        weighed = [weigh(terms, df, len(listings)) for terms in all_terms]
+        buckets = np.concatenate([b for b, w in weighed] or [np.zeros(0, np.int32)])
+        weights = np.concatenate([w for b, w in weighed] or [np.zeros(0, np.float32)])
+        rows = np.repeat(np.arange(len(listings), dtype=np.int32),
+                         [len(b) for b, w in weighed]).astype(np.int32)
+
+        # postings: every (row, weight) grouped by bucket
+        order = np.argsort(buckets, kind='stable')
+        offsets = np.zeros(HASH_BUCKETS + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(buckets, minlength=HASH_BUCKETS))
+
+        os.makedirs(self.path, exist_ok=True)
+        name = f"gen-{time.time_ns()}-{os.getpid()}"
+        generation = self._file(name)
+        os.mkdir(generation)
+
+        for filename, data in (
+                ('ids.i64', np.array([l.id for l in listings], dtype=np.int64)),
+                ('offsets.i64', offsets),
+                ('rows.i32', rows[order]),
+                ('weights.f32', weights[order]),
+                ('df.i64', df),
+                ('delta_ids.i64', np.zeros(0, dtype=np.int64)),
+                ('delta_lengths.i32', np.zeros(0, dtype=np.int32)),
+                ('delta_buckets.i32', np.zeros(0, dtype=np.int32)),
+                ('delta_weights.f32', np.zeros(0, dtype=np.float32))):
+            data.tofile(os.path.join(generation, filename))
+
+        with self._locked():
+            previous = self._current()
+
+            if os.path.lexists(self._file('current.tmp')):
+                os.remove(self._file('current.tmp'))
+            os.symlink(name, self._file('current.tmp'))
+            os.replace(self._file('current.tmp'), self._file('current'))
+
+            # keep the previous generation for readers that are mid-refresh;
+            # anything else is older still, or left by a build that died
+            keep = {name, previous and os.path.basename(previous)}
+            for old in os.listdir(self.path):
+                if old.startswith('gen-') and old not in keep:
+                    shutil.rmtree(self._file(old), ignore_errors=True)
+
+        self._version = None
+
+    def built_at(self):
+        """When the live generation was built (epoch seconds), or None."""
+
+        generation = self._current()
+
+        # from the name: appends and removals touch the files and directory
+        return int(os.path.basename(generation).split('-')[1]) / 1e9 if generation else None
+
+    def similar(self, listing, k=5):
+        """Ids of the `k` listings most similar to `listing`, best first.
+
+        [] until the index has been built.
+        """
+
+        self._refresh()
+
+        if self.generation is None:
+            return []
+
+        df = self._read_df(self.generation)
+        buckets, weights = weigh(listing_terms(listing), df, df[HASH_BUCKETS])
+
+        # built rows: walk the postings of the query's buckets only
+        starts, ends = self.offsets[buckets], self.offsets[buckets + 1]
+        postings = np.concatenate(
+            [np.arange(s, e) for s, e in zip(starts, ends)] or [np.zeros(0, np.int64)])
+        query_weights = np.repeat(weights, ends - starts)
+        scores = np.bincount(self.rows[postings],
+                             weights=query_weights * self.weights[postings],
+                             minlength=len(self.ids))
+
+        # rows added since the build: score every entry
+        if len(self.delta_ids):
+            query = np.zeros(HASH_BUCKETS, dtype=np.float32)
+            query[buckets] = weights
+            delta_scores = np.bincount(
+                self.delta_rows,
+                weights=query[self.delta_buckets] * self.delta_weights,
+                minlength=len(self.delta_ids))
+            scores = np.concatenate([scores, delta_scores])
+            ids = np.concatenate([self.ids, self.delta_ids])
+        else:
+            ids = np.asarray(self.ids)
+
+        if not len(ids):
+            return []
+
+        scores[(ids < 0) | (ids == listing.id)] = -np.inf
+
+        # take a few extra in case a listing was indexed more than once
+        wanted = min(k * 2, len(scores))
+        top = np.argpartition(scores, -wanted)[-wanted:]
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        result = []
+        for row in top:
+            listing_id = int(ids[row])
+            if scores[row] > -np.inf and listing_id not in result:
+                result.append(listing_id)
+
+        return result[:k]
+
+
+def rebuild_if_stale(index, build, max_age=REBUILD_SECONDS):
+    """Rebuild `index` if it's missing or older than `max_age` seconds.
+
+    Only one process per machine builds at a time; the others skip the
+    round. Returns whether this call rebuilt the index.
+    """
+
+    lock = index._locked('build.lock', blocking=False)
+    if lock is None:
+        return False
+
+    with lock:
+        built_at = index.built_at()
+        if built_at is not None and time.time() - built_at < max_age:
+            return False
+
+        build(index)
+
+    return True
+
+
+_builder = None
+
+
+def start_background_builds(index, build, every=REBUILD_SECONDS):
+    """Keep `index` built from a daemon thread; once per process.
+
+    `build(index)` does the rebuild, e.g. inside an app context.
+    """
+
+    global _builder
+
+    if _builder is not None or every <= 0:
+        return
+
+    def run():
+        while True:
+            try:
+                rebuild_if_stale(index, build, every)
+            except Exception as e:
+                print("similar-listings build failed:", e)
+            time.sleep(min(every, 300))
+
+    _builder = threading.Thread(target=run, name='similar-builder', daemon=True)
+    _builder.start()
+
+
+@lru_cache(maxsize=None)
+def get_similar_index():
+    """The index shared by this process."""
+
+    return SimilarityIndex()
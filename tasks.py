@@ -0,0 +1,26 @@
+"""Handlers for background jobs (see jobs.py)."""
+
+from base64 import b64decode
+
+from jobs import job
+from message_archive import archive_cold_messages, ensure_partitions
+from models import db, Image
+from upload import upload_bytes_to_aws
+
+
+@job('upload_listing_image')
+def upload_listing_image(listing_id, user, filename, mimetype, data):
+    """Upload a listing photo to S3 and attach it to the listing."""
+
+    url = upload_bytes_to_aws(b64decode(data), filename, mimetype)
+
+    Image.add_image(listing_id=listing_id, user=user, image_url=url)
+    db.session.commit()
+
+
+@job('archive_messages')
+def archive_messages():
+    """Create upcoming message partitions and archive cold months."""
+
+    ensure_partitions()
+    archive_cold_messages()
@@ -0,0 +1,57 @@
+"""Shared fixtures: the app against a throwaway SQLite database.
+
+The environment has to be set before `app` is imported, since app.py reads
+DATABASE_URL at import time. Set TEST_DATABASE_URL to run the suite against
+a scratch PostgreSQL database instead (its tables are dropped).
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+TMP_DIR = tempfile.mkdtemp(prefix="sharebnb-tests-")
+
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL",
+                                           f"sqlite:///{TMP_DIR}/test.db")
+os.environ["SECRET_KEY"] = "test-secret"
+os.environ["SIMILAR_INDEX_DIR"] = os.path.join(TMP_DIR, "similar")
+# no background index builds racing the tests
+os.environ["SIMILAR_REBUILD_SECONDS"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        yield flask_app
+
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def token(client):
+    """Sign up `testuser` and return their token."""
+
+    resp = client.post("/signup", json={
+        "username": "testuser",
+        "password": "password",
+        "first_name": "Test",
+        "last_name": "User",
+        "email": "test@test.com",
+    })
+
+    return resp.json["token"]
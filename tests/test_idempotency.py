@@ -0,0 +1,130 @@
+import io
+import threading
+from datetime import datetime, timedelta
+
+from helpers import create_token
+from models import db, Listing, Message, IdempotencyKey
+
+
+LISTING = {
+    "title": "Pool",
+    "description": "A nice pool",
+    "location": "LA",
+    "type": "pool",
+    "price_per_night": "40",
+}
+
+
+def add_listing(client, token, key, boundary=None, files=None):
+    data = dict(LISTING)
+    if files:
+        data["image"] = files
+    headers = {"token": token, "Idempotency-Key": key}
+
+    if boundary:
+        return client.post("/listings", headers=headers, data=data,
+                           content_type=f"multipart/form-data; boundary={boundary}")
+
+    return client.post("/listings", headers=headers, data=data)
+
+
+def test_retry_replays_first_response(client, token):
+    first = add_listing(client, token, "k1")
+    retry = add_listing(client, token, "k1")
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json == first.json
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert Listing.query.count() == 1
+
+
+def test_same_key_different_request_is_rejected(client, token):
+    add_listing(client, token, "k1")
+    resp = client.post("/listings", headers={"token": token, "Idempotency-Key": "k1"},
+                       data={**LISTING, "title": "Other"})
+
+    assert resp.status_code == 422
+    assert Listing.query.count() == 1
+
+
+def test_keys_are_scoped_to_the_user(client, token):
+    client.post("/signup", json={
+        "username": "otheruser", "password": "password", "first_name": "O",
+        "last_name": "U", "email": "other@test.com"})
+
+    first = add_listing(client, token, "k1")
+    other = add_listing(client, create_token("otheruser"), "k1")
+
+    assert first.status_code == other.status_code == 200
+    assert "Idempotent-Replayed" not in other.headers
+    assert Listing.query.count() == 2
+
+
+def test_rebuilt_multipart_form_matches(client, token):
+    first = add_listing(client, token, "k1", boundary="AAA",
+                        files=[(io.BytesIO(b"photo"), "a.png")])
+    retry = add_listing(client, token, "k1", boundary="BBB",
+                        files=[(io.BytesIO(b"photo"), "a.png")])
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json == first.json
+    assert Listing.query.count() == 1
+
+
+def test_failure_after_commit_is_not_redone(client, token, monkeypatch):
+    def broken_serialize(self):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(Listing, "serialize", broken_serialize)
+
+    first = add_listing(client, token, "k1")
+    retry = add_listing(client, token, "k1")
+
+    assert first.status_code == retry.status_code == 500
+    assert Listing.query.count() == 1
+
+
+def test_abandoned_key_can_be_reclaimed(client, token):
+    db.session.add(IdempotencyKey(
+        key="testuser POST /listings k1", request_hash="x",
+        created_at=datetime.utcnow() - IdempotencyKey.LEASE - timedelta(seconds=1)))
+    db.session.commit()
+
+    resp = add_listing(client, token, "k1")
+
+    assert resp.status_code == 200
+    assert Listing.query.count() == 1
+
+
+def test_auth_responses_are_not_stored(client, token):
+    resp = client.post("/login", headers={"Idempotency-Key": "k1"},
+                       json={"username": "testuser", "password": "password"})
+
+    assert resp.status_code == 200
+    assert IdempotencyKey.query.count() == 0
+
+
+def test_concurrent_duplicates_create_one_message(app, client, token):
+    listing_id = add_listing(client, token, "setup").json["listing"]["id"]
+    results = []
+    start = threading.Barrier(8)
+
+    def send():
+        with app.test_client() as c:
+            start.wait()
+            resp = c.post(f"/listings/{listing_id}/messages",
+                          headers={"token": token, "Idempotency-Key": "m1"},
+                          json={"to_user": "testuser", "body": "hello"})
+            results.append((resp.status_code, resp.json))
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert Message.query.count() == 1
+    assert {status for status, _ in results} <= {200, 409}
+
+    message_ids = {body["message"]["id"] for status, body in results if status == 200}
+    assert len(message_ids) == 1
@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+
+from models import db, Booking, Image, Listing
+
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+
+def add_listing(title):
+    listing = Listing.add_listing(title=title, description="A place",
+                                  location="LA", type="pool",
+                                  price_per_night="40.00", user_id="testuser")
+    db.session.commit()
+
+    return listing.id
+
+
+def add_booking(listing_id, start, end, guest="testuser"):
+    booking = Booking(listing_id=listing_id, start_date=day(start),
+                      end_date=day(end), guest=guest)
+    db.session.add(booking)
+    db.session.commit()
+
+    return booking.id
+
+
+def itinerary(client, token, query=""):
+    resp = client.get(f"/bookings?view=itinerary{query}", headers={"token": token})
+    assert resp.status_code == 200
+
+    return resp.json
+
+
+def test_upcoming_and_past_are_split_and_ordered(client, token):
+    listing_id = add_listing("Pool")
+    later = add_booking(listing_id, 20, 22)
+    current = add_booking(listing_id, -1, 1)
+    checked_out_today = add_booking(listing_id, -3, 0)
+    long_ago = add_booking(listing_id, -30, -28)
+    recent = add_booking(listing_id, -10, -8)
+    add_booking(listing_id, 5, 7, guest="someone-else")
+
+    upcoming = itinerary(client, token)["bookings"]
+    past = itinerary(client, token, "&when=past")["bookings"]
+    everything = itinerary(client, token, "&when=all")["bookings"]
+
+    # still there on check-out day; soonest first
+    assert [b["id"] for b in upcoming] == [checked_out_today, current, later]
+    # most recent first
+    assert [b["id"] for b in past] == [recent, long_ago]
+    assert [b["id"] for b in everything] == [long_ago, recent, checked_out_today,
+                                             current, later]
+
+
+def test_pages(client, token):
+    listing_id = add_listing("Pool")
+    ids = [add_booking(listing_id, d, d + 1) for d in range(1, 6)]
+
+    first = itinerary(client, token, "&per_page=2")
+    second = itinerary(client, token, "&per_page=2&page=2")
+    last = itinerary(client, token, "&per_page=2&page=3")
+    beyond = itinerary(client, token, "&per_page=2&page=4")
+
+    assert [b["id"] for b in first["bookings"]] == ids[:2]
+    assert (first["page"], first["perPage"], first["hasMore"]) == (1, 2, True)
+    assert [b["id"] for b in second["bookings"]] == ids[2:4]
+    assert second["hasMore"] is True
+    assert [b["id"] for b in last["bookings"]] == ids[4:]
+    assert last["hasMore"] is False
+    assert beyond["bookings"] == [] and beyond["hasMore"] is False
+
+
+def test_exactly_a_full_page_has_no_more(client, token):
+    listing_id = add_listing("Pool")
+    for d in range(1, 3):
+        add_booking(listing_id, d, d + 1)
+
+    assert itinerary(client, token, "&per_page=2")["hasMore"] is False
+
+
+def test_page_size_is_clamped(client, token):
+    assert itinerary(client, token, "&per_page=1000")["perPage"] == 100
+    assert itinerary(client, token, "&per_page=0&page=0")["page"] == 1
+
+
+def test_listing_summary_uses_the_first_image(client, token):
+    with_images = add_listing("Pool")
+    without_images = add_listing("Yard")
+    Image.add_image(listing_id=with_images, user="testuser", image_url="first.jpg")
+    Image.add_image(listing_id=with_images, user="testuser", image_url="second.jpg")
+    db.session.commit()
+    add_booking(with_images, 1, 2)
+    add_booking(without_images, 3, 4)
+
+    bookings = itinerary(client, token)["bookings"]
+
+    assert [b["listing"]["title"] for b in bookings] == ["Pool", "Yard"]
+    assert [b["listing"]["imageUrl"] for b in bookings] == ["first.jpg", None]
+    assert bookings[0]["listing"]["pricePerNight"] == "40.00"
+
+
+def test_listings_by_ids_keep_the_requested_order(client):
+    first, second, third = add_listing("A"), add_listing("B"), add_listing("C")
+
+    resp = client.get(f"/listings?ids={third},999,{first},{second}")
+
+    assert resp.status_code == 200
+    assert [l["id"] for l in resp.json["listings"]] == [third, first, second]
+
+
+def test_listings_by_ids_rejects_garbage(client):
+    resp = client.get("/listings?ids=1,x")
+
+    assert resp.status_code == 400
+    assert "ids" in resp.json["errors"]
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import jobs
+from models import db, Job
+
+
+@jobs.job('test_noop')
+def noop(**payload):
+    pass
+
+
+@jobs.job('test_broken')
+def broken(**payload):
+    raise RuntimeError("boom")
+
+
+def test_finished_job_drops_its_payload(app):
+    jobs.enqueue('test_noop', data="x" * 1000)
+    db.session.commit()
+
+    jobs.run_worker(burst=True)
+
+    job = Job.query.one()
+    assert job.status == 'done'
+    assert job.payload == "{}"
+
+
+def test_failing_job_retries_then_fails(app):
+    jobs.enqueue('test_broken', max_attempts=2)
+    db.session.commit()
+
+    jobs.run_worker(burst=True)
+    job = Job.query.one()
+    assert job.status == 'queued'
+    assert job.run_at > datetime.utcnow()
+
+    job.run_at = datetime.utcnow()
+    db.session.commit()
+    jobs.run_worker(burst=True)
+
+    job = Job.query.one()
+    assert job.status == 'failed'
+    assert "boom" in job.last_error
+
+
+def test_purge_finished_keeps_recent_and_pending_jobs(app):
+    old = datetime.utcnow() - jobs.KEEP_FINISHED - timedelta(days=1)
+    db.session.add_all([
+        Job(name='test_noop', status='done', updated_at=old),
+        Job(name='test_noop', status='failed', updated_at=old),
+        Job(name='test_noop', status='done'),
+        Job(name='test_noop', status='queued', updated_at=old),
+    ])
+    db.session.commit()
+
+    assert jobs.purge_finished() == 2
+    assert sorted(j.status for j in Job.query) == ['done', 'queued']
+
+
+def test_stale_job_is_requeued_until_out_of_attempts(app):
+    stale = datetime.utcnow() - jobs.STALE_AFTER - timedelta(minutes=1)
+    db.session.add_all([
+        Job(name='test_noop', status='running', attempts=1, max_attempts=3,
+            updated_at=stale),
+        Job(name='test_noop', status='running', attempts=3, max_attempts=3,
+            updated_at=stale),
+    ])
+    db.session.commit()
+
+    assert jobs.requeue_stale() == 1
+    assert sorted(j.status for j in Job.query) == ['failed', 'queued']
@@ -0,0 +1,63 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import message_archive
+from helpers import ConfigError
+from models import db, Listing, Message
+
+
+@pytest.fixture
+def cold_month(app, token):
+    """Three messages from a month well outside the hot window."""
+
+    listing = Listing.add_listing(title="Pool", description="A pool",
+                                  location="LA", type="pool",
+                                  price_per_night="40.00", user_id="testuser")
+    db.session.commit()
+
+    month = message_archive.month_start(
+        date.today() - timedelta(days=message_archive.HOT_DAYS + 90))
+
+    for day in (1, 2, 3):
+        db.session.add(Message(listing_id=listing.id, to_user="testuser",
+                               from_user="testuser", body=f"day {day}",
+                               timestamp=datetime(month.year, month.month, day)))
+    db.session.commit()
+
+    return month
+
+
+def test_archived_month_is_stored_then_deleted(cold_month, tmp_path, monkeypatch):
+    monkeypatch.setattr(message_archive, "ARCHIVE_DIR", str(tmp_path))
+
+    assert message_archive.archive_month(cold_month) == 3
+    assert Message.query.count() == 0
+
+    archived = message_archive.load_archived_messages(f"{cold_month:%Y-%m}")
+    assert [m["body"] for m in archived] == ["day 1", "day 2", "day 3"]
+
+
+def test_rows_stay_when_the_archive_cannot_be_stored(cold_month, monkeypatch):
+    def broken_store(month, path):
+        raise OSError("bucket unreachable")
+
+    monkeypatch.setattr(message_archive, "store_archive", broken_store)
+    monkeypatch.setattr(message_archive, "ARCHIVE_DIR", None)
+    monkeypatch.setenv("BUCKET", "sharebnb-test")
+    monkeypatch.setattr(message_archive, "fetch_archive", lambda month, path: False)
+
+    with pytest.raises(OSError):
+        message_archive.archive_month(cold_month)
+
+    assert Message.query.count() == 3
+
+
+def test_archiving_needs_somewhere_durable(cold_month, monkeypatch):
+    monkeypatch.setattr(message_archive, "ARCHIVE_DIR", None)
+    monkeypatch.delenv("BUCKET", raising=False)
+
+    with pytest.raises(ConfigError):
+        message_archive.archive_month(cold_month)
+
+    assert Message.query.count() == 3
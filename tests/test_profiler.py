@@ -0,0 +1,89 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify
+
+import profiler
+from helpers import create_token
+from models import db, Profile
+
+
+def make_app(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_SAMPLE_RATE", 1.0)
+    monkeypatch.setenv("ADMIN_USERNAMES", "admin")
+
+    app = Flask(__name__)
+    profiler.init_request_profiling(app)
+
+    @app.get("/ping")
+    def ping():
+        return jsonify(ok=True)
+
+    return app.test_client()
+
+
+def test_profiled_request_returns_its_stats(monkeypatch):
+    client = make_app(monkeypatch)
+
+    resp = client.get("/ping", headers={"X-Profile": "1",
+                                        "token": create_token("admin")})
+
+    assert resp.json["ok"] is True
+    assert "cumulative" in resp.json["profile"]
+    assert "X-Profile-File" not in resp.headers
+
+
+def test_only_admins_are_profiled(monkeypatch):
+    client = make_app(monkeypatch)
+
+    resp = client.get("/ping", headers={"X-Profile": "1",
+                                        "token": create_token("someone")})
+
+    assert resp.json == {"ok": True}
+
+
+def test_profile_is_served_from_the_database(client, token, monkeypatch):
+    monkeypatch.setenv("ADMIN_USERNAMES", "testuser")
+    headers = {"token": token}
+
+    resp = client.post("/admin/profile?seconds=1&interval_ms=5", headers=headers)
+    assert resp.status_code == 202
+    profile_id = resp.json["profile"]["id"]
+
+    # poll as a client would; the sampler thread saves the result itself,
+    # so this works whichever worker answers
+    deadline = time.monotonic() + 10
+    while (resp := client.get("/admin/profile", headers=headers)).status_code == 202:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    assert resp.status_code == 200
+    assert resp.json["profiles"][0]["name"].endswith(f"worker {os.getpid()}")
+    assert resp.json["shared"]["frames"]
+
+    collapsed = client.get(f"/admin/profile?id={profile_id}&format=collapsed",
+                           headers=headers)
+    assert collapsed.data.decode() == Profile.query.get(profile_id).collapsed
+
+
+def test_profile_whose_worker_died_is_a_404(client, token, monkeypatch):
+    monkeypatch.setenv("ADMIN_USERNAMES", "testuser")
+    db.session.add(Profile(host="web.2", pid=1, seconds=10, interval_ms=10,
+                           started_at=datetime.utcnow() - timedelta(minutes=5)))
+    db.session.commit()
+
+    resp = client.get("/admin/profile", headers={"token": token})
+
+    assert resp.status_code == 404
+    assert resp.json["profile"]["running"] is False
+
+
+def test_only_the_newest_profiles_are_kept(app):
+    db.session.add_all([Profile(host="web.1", pid=1, seconds=1, interval_ms=10)
+                        for _ in range(Profile.KEEP + 5)])
+    db.session.commit()
+
+    assert Profile.purge_old() == 5
+    db.session.commit()
+    assert min(id for id, in db.session.query(Profile.id)) == 6
@@ -0,0 +1,122 @@
+from datetime import date, timedelta
+
+from schemas import (ListingSchema, BookingSchema, CalendarSchema,
+                     CalendarBatchSchema, to_price)
+
+import pytest
+
+
+def days_from_now(days):
+    return (date.today() + timedelta(days=days)).isoformat()
+
+
+LISTING = {
+    "title": "Pool",
+    "description": "A nice pool",
+    "location": "LA",
+    "type": "pool",
+    "price_per_night": "$40",
+}
+
+
+def test_price_is_normalised():
+    assert to_price("$40") == "40.00"
+    assert to_price("12.5") == "12.50"
+
+
+@pytest.mark.parametrize("price", ["1e30", "-1", "NaN", "Infinity", "abc", "1000000.01"])
+def test_bad_prices_are_validation_errors(price):
+    cleaned, errors = ListingSchema.validate({**LISTING, "price_per_night": price})
+
+    assert "price_per_night" in errors
+
+
+def test_huge_price_is_a_400_not_a_500(client, token):
+    resp = client.post("/listings", headers={"token": token},
+                       data={**LISTING, "price_per_night": "1e30"})
+
+    assert resp.status_code == 400
+    assert "price_per_night" in resp.json["errors"]
+
+
+def test_booking_dates_are_coerced():
+    cleaned, errors = BookingSchema.validate({
+        "listing_id": "3", "start_date": days_from_now(30), "end_date": days_from_now(33)})
+
+    assert errors == {}
+    assert cleaned["listing_id"] == 3
+    assert cleaned["end_date"].isoformat() == days_from_now(33)
+
+
+@pytest.mark.parametrize("start, end, field", [
+    ("0001-01-01", days_from_now(3), "start_date"),
+    (days_from_now(-30), days_from_now(-27), "start_date"),
+    (days_from_now(2000), days_from_now(2003), "start_date"),
+    (days_from_now(1), "9999-12-31", "end_date"),
+    (days_from_now(1), days_from_now(367), "end_date"),
+])
+def test_booking_dates_are_bounded(start, end, field):
+    cleaned, errors = BookingSchema.validate({
+        "listing_id": "3", "start_date": start, "end_date": end})
+
+    assert field in errors
+
+
+def test_calendar_range_defaults_to_thirty_days():
+    cleaned, errors = CalendarSchema.validate({})
+
+    assert errors == {}
+    assert (cleaned["to"] - cleaned["from"]).days == 29
+
+
+@pytest.mark.parametrize("args", [
+    {"to": days_from_now(800)},
+    {"to": "9999-12-31"},
+    {"from": "9999-12-31"},
+    {"from": days_from_now(0), "to": days_from_now(731)},
+])
+def test_calendar_range_is_capped_with_defaults_filled_in(args):
+    cleaned, errors = CalendarSchema.validate(args)
+
+    assert "to" in errors
+
+
+def test_batch_calendar_range_is_shorter():
+    cleaned, errors = CalendarBatchSchema.validate(
+        {"ids": "1,2", "from": days_from_now(0), "to": days_from_now(91)})
+    assert errors == {}
+
+    cleaned, errors = CalendarBatchSchema.validate(
+        {"ids": "1,2", "from": days_from_now(0), "to": days_from_now(92)})
+    assert "to" in errors
+
+
+def test_out_of_range_booking_is_a_400(client, token):
+    resp = client.post("/bookings", headers={"token": token}, json={
+        "listing_id": 1, "start_date": "0001-01-01", "end_date": "0001-01-03"})
+
+    assert resp.status_code == 400
+    assert "start_date" in resp.json["errors"]
+
+
+@pytest.mark.parametrize("value", ["2030-01-01xyz", "2030-01-01 junk", "2030-1-1"])
+def test_dates_with_trailing_junk_are_rejected(value):
+    cleaned, errors = BookingSchema.validate({
+        "listing_id": "3", "start_date": value, "end_date": days_from_now(3)})
+
+    assert "start_date" in errors
+
+
+def test_iso_datetimes_are_accepted_as_dates():
+    cleaned, errors = CalendarSchema.validate({"from": days_from_now(1) + "T00:00:00"})
+
+    assert errors == {}
+    assert cleaned["from"].isoformat() == days_from_now(1)
+
+
+@pytest.mark.parametrize("body", [[1], "text", 3])
+def test_non_object_json_is_a_400(client, token, body):
+    resp = client.post("/bookings", headers={"token": token}, json=body)
+
+    assert resp.status_code == 400
+    assert "body" in resp.json["errors"]
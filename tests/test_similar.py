@@ -0,0 +1,132 @@
+import random
+from collections import Counter
+from math import log, sqrt
+from types import SimpleNamespace
+
+from similar import SimilarityIndex, listing_terms, rebuild_if_stale
+
+
+def make_listing(id, title, description):
+    return SimpleNamespace(id=id, title=title, description=description,
+                           type="house", location="Oakland")
+
+
+BEACH = [
+    make_listing(1, "Beach house", "ocean view sand surf"),
+    make_listing(2, "Surf shack", "sand surf ocean beach"),
+    make_listing(3, "City loft", "downtown nightlife bars"),
+]
+
+
+def exact_top_k(listings, query, k):
+    """Top-k by exact TF-IDF cosine over the real (unhashed) terms."""
+
+    terms = {l.id: listing_terms(l) for l in listings}
+    df = Counter(t for counts in terms.values() for t in counts)
+    n = len(listings)
+
+    def vector(counts):
+        v = {t: (1 + log(tf)) * (log((1 + n) / (1 + df[t])) + 1)
+             for t, tf in counts.items()}
+        norm = sqrt(sum(w * w for w in v.values()))
+        return {t: w / norm for t, w in v.items()}
+
+    vectors = {id: vector(counts) for id, counts in terms.items()}
+    q = vectors[query.id]
+    scores = {id: sum(w * q.get(t, 0) for t, w in v.items())
+              for id, v in vectors.items() if id != query.id}
+
+    return sorted(scores, key=lambda id: -scores[id])[:k]
+
+
+def test_recall_against_exact_cosine(tmp_path):
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(400)]
+    listings = [make_listing(i, " ".join(rng.choices(vocabulary, k=3)),
+                             " ".join(rng.choices(vocabulary, k=12)))
+                for i in range(1, 3001)]
+
+    index = SimilarityIndex(str(tmp_path))
+    index.rebuild(listings)
+
+    found = 0
+    queries = listings[:100]
+    for query in queries:
+        expected = exact_top_k(listings, query, 5)
+        found += len(set(expected) & set(index.similar(query, 5)))
+
+    assert found / (5 * len(queries)) >= 0.95
+
+
+def test_lookups_are_empty_until_built(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+
+    assert index.similar(BEACH[0]) == []
+
+    index.add(BEACH[1])
+    assert index.similar(BEACH[0]) == []
+
+
+def test_reader_sees_a_new_generation(tmp_path):
+    writer = SimilarityIndex(str(tmp_path))
+    reader = SimilarityIndex(str(tmp_path))
+
+    writer.rebuild(BEACH)
+    assert reader.similar(BEACH[0], 1) == [2]
+
+    writer.rebuild([make_listing(1, "Beach house", "ocean view sand surf"),
+                    make_listing(4, "Beach cottage", "ocean sand surf view"),
+                    make_listing(3, "City loft", "downtown nightlife bars")])
+    assert reader.similar(BEACH[0], 1) == [4]
+
+
+def test_added_listing_is_found_before_the_next_rebuild(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.rebuild(BEACH)
+    reader = SimilarityIndex(str(tmp_path))
+    assert reader.similar(BEACH[0], 1) == [2]
+
+    index.add(make_listing(5, "Beach house", "ocean view sand surf"))
+
+    assert reader.similar(BEACH[0], 1) == [5]
+
+
+def test_removed_listing_is_not_returned(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    index.rebuild(BEACH)
+    index.add(make_listing(5, "Beach house", "ocean view sand surf"))
+    reader = SimilarityIndex(str(tmp_path))
+    assert reader.similar(BEACH[0], 2) == [5, 2]
+
+    index.remove(2)
+    index.remove(5)
+
+    assert reader.similar(BEACH[0], 5) == [3]
+
+
+def test_rebuild_if_stale_builds_once(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    builds = []
+
+    def build(index):
+        builds.append(1)
+        index.rebuild(BEACH)
+
+    assert rebuild_if_stale(index, build, max_age=60)
+    assert not rebuild_if_stale(index, build, max_age=60)
+    assert not rebuild_if_stale(SimilarityIndex(str(tmp_path)), build, max_age=60)
+    assert rebuild_if_stale(index, build, max_age=0)
+
+    assert len(builds) == 2
+    assert index.similar(BEACH[0], 1) == [2]
+
+
+def test_similar_route_does_not_build_in_the_request(client, token):
+    listing = client.post("/listings", headers={"token": token}, data={
+        "title": "Pool", "description": "A nice pool", "location": "LA",
+        "type": "pool", "price_per_night": "40"}).json["listing"]
+
+    resp = client.get(f"/listings/{listing['id']}/similar")
+
+    assert resp.status_code == 200
+    assert resp.json == {"listings": []}
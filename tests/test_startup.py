@@ -0,0 +1,74 @@
+"""Importing the app must stay cheap: no heavy dependencies, no config needed."""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the framework every request needs anyway; what `import app` adds on top
+# of it must stay under OWN_IMPORT_RATIO of its import time. Both are timed
+# in the same interpreter, so a busy machine slows them down alike.
+FRAMEWORK = "flask_sqlalchemy, flask_cors, jwt, dotenv"
+OWN_IMPORT_RATIO = 0.25
+
+# only needed once an upload, debug page, password check or `flask db`
+# command actually happens
+LAZY_MODULES = ["boto3", "botocore", "flask_debugtoolbar", "bcrypt",
+                "flask_bcrypt", "numpy", "flask_migrate", "alembic"]
+
+
+def import_app(code="import app"):
+    """Import the app in a clean interpreter with only DATABASE_URL set."""
+
+    env = {"PATH": os.environ.get("PATH", ""), "DATABASE_URL": "sqlite://"}
+
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+def test_import_without_production_config():
+    result = import_app()
+
+    assert result.returncode == 0, result.stderr
+
+
+def test_heavy_dependencies_are_not_imported():
+    result = import_app(
+        "import sys, app; print(','.join(m for m in %r if m in sys.modules))"
+        % LAZY_MODULES)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+
+def test_import_time_budget():
+    # best of three, to keep a busy machine from failing the build
+    code = ("import time; t = time.perf_counter(); import %s; "
+            "b = time.perf_counter() - t; t = time.perf_counter(); import app; "
+            "print(b, time.perf_counter() - t)" % FRAMEWORK)
+    ratios = []
+
+    for _ in range(3):
+        result = import_app(code)
+        assert result.returncode == 0, result.stderr
+        framework, own = map(float, result.stdout.split())
+        ratios.append(own / framework)
+
+    assert min(ratios) < OWN_IMPORT_RATIO, (
+        f"import app costs {min(ratios):.0%} of the framework's import time")
+
+
+def test_requests_fail_clearly_without_secret_key(client, monkeypatch):
+    monkeypatch.delenv("SECRET_KEY")
+
+    resp = client.post("/signup", json={
+        "username": "nokey",
+        "password": "password",
+        "first_name": "No",
+        "last_name": "Key",
+        "email": "nokey@test.com",
+    })
+
+    assert resp.status_code == 500
+    assert resp.json == {"error": "Server misconfigured"}
@@ -1,34 +1,75 @@
 import os
+from functools import lru_cache
+from io import BytesIO
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import uuid
 
 load_dotenv()
 
-import boto3
 
-ACCESS = os.environ['ACCESS_KEY']
-SECRET = os.environ['ACCESS_SECRET_KEY']
-BUCKET = os.environ['BUCKET']
+@lru_cache(maxsize=None)
+def get_s3_client():
+  """Build the S3 client on first upload.
 
-def upload_to_aws(file):
+  boto3 is slow to import, so it (and the AWS credentials) are only
+  loaded once something actually needs to talk to S3.
+  """
+
+  import boto3
 
-  s3 = boto3.client(
+  return boto3.client(
     "s3",
     "us-west-1",
-    aws_access_key_id=ACCESS,
-    aws_secret_access_key=SECRET,
+    aws_access_key_id=os.environ['ACCESS_KEY'],
+    aws_secret_access_key=os.environ['ACCESS_SECRET_KEY'],
   )
 
+
+def upload_to_aws(file):
+
+  return upload_fileobj_to_aws(file, file.filename, file.mimetype)
+
+
+def upload_bytes_to_aws(data, filename, mimetype):
+  """Upload raw image bytes (e.g. from a queued job) and return the URL."""
+
+  return upload_fileobj_to_aws(BytesIO(data), filename, mimetype)
+
+
+def upload_fileobj_to_aws(file, filename, img_type):
+
+  s3 = get_s3_client()
+  bucket = os.environ['BUCKET']
+
   img_id = str(uuid.uuid4())
-  object_name = img_id + "/" + secure_filename(file.filename)
-  img_type = file.mimetype
+  object_name = img_id + "/" + secure_filename(filename)
 
   ## upload_file_obj
-  s3.upload_fileobj(file, BUCKET, object_name,
+  s3.upload_fileobj(file, bucket, object_name,
     ExtraArgs={"ContentType" : img_type})
 
-  objURL = "https://" + BUCKET + ".s3.us-west-1.amazonaws.com/" + object_name
-  
+  objURL = "https://" + bucket + ".s3.us-west-1.amazonaws.com/" + object_name
+
   return (objURL)
 
+
+def upload_file_to_aws(path, key):
+  """Upload a local file to `key` in the bucket (private, unlike images)."""
+
+  get_s3_client().upload_file(path, os.environ['BUCKET'], key)
+
+
+def download_file_from_aws(key, path):
+  """Download `key` from the bucket to `path`; False if there's no such key."""
+
+  from botocore.exceptions import ClientError
+
+  try:
+    get_s3_client().download_file(os.environ['BUCKET'], key, path)
+  except ClientError as e:
+    if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+      return False
+    raise
+
+  return True
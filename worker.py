@@ -0,0 +1,16 @@
+"""Background job worker.
+
+Run with `python worker.py`; pass `--burst` to exit once the queue is empty.
+"""
+
+import sys
+
+from app import app
+from jobs import run_worker
+
+import tasks  # noqa: F401 -- registers the job handlers
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        run_worker(burst='--burst' in sys.argv)